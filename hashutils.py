@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+ Streaming file hashes for iPBA
+
+ Files are read once, in fixed size blocks, and every block is fed to all the
+ requested hash functions: the memory used does not depend on the size of the file.
+'''
+
+import sys
+import time
+import hashlib
+
+# the hashes shown for each file (see ManifestMBDB.fileHashes)
+hashNames = ('md5', 'sha1')
+
+blockSize = 1024 * 1024
+
+class MultiHash(object):
+	"""Computes several hashlib hashes of the same data at once"""
+
+	def __init__(self, names=hashNames, data=''):
+		self._hashes = [(name, hashlib.new(name)) for name in names]
+		if data:
+			self.update(data)
+
+	def update(self, data):
+		for name, h in self._hashes:
+			h.update(data)
+
+	def hexdigests(self):
+		"""Return the hex digests as a dict, by hash name"""
+		return dict((name, h.hexdigest()) for name, h in self._hashes)
+
+def hashStream(fh, names=hashNames, size=blockSize, data=''):
+	"""Hash what is left to read of the file object fh (preceded by data, which the caller
+	already read from it), size bytes at a time. Returns the hex digests by hash name."""
+	hashes = MultiHash(names, data)
+	while True:
+		data = fh.read(size)
+		if not data:
+			break
+		hashes.update(data)
+	return hashes.hexdigests()
+
+def hashFile(filename, names=hashNames, size=blockSize):
+	"""Return the hex digests, by hash name, of the content of the file"""
+	fh = open(filename, 'rb')
+	try:
+		return hashStream(fh, names, size)
+	finally:
+		fh.close()
+
+if __name__ == '__main__':
+	# prints the hashes of the files given on the command line, and the throughput
+	for filename in sys.argv[1:]:
+		start = time.time()
+		hashes = hashFile(filename)
+		elapsed = time.time() - start
+		print u'%s  %s  %s' % (u'  '.join(hashes[name] for name in hashNames), filename, u'(%.1f s)' % elapsed)
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+ Hex formatting of binary data for iPBA (main window, hex viewer, plugins)
+
+ The data is converted as a whole: binascii.hexlify for the hex digits and str.translate
+ for the printable characters (and to uppercase the digits). Spaced hex is built by
+ interleaving slices; a dump is built a column at a time, each column of its rows being
+ filled from one extended slice of the digits or characters. No byte is formatted on its
+ own, and no string is made per row.
+'''
+
+import sys
+import time
+import array
+import binascii
+
+# printable characters are shown as they are, all others as dots
+FILTER = ''.join([(len(repr(chr(x))) == 3) and chr(x) or '.' for x in range(256)])
+# uppercase hex digits: str.translate is several times faster than str.upper
+UPPER = ''.join([chr(x).upper() for x in range(256)])
+# rows of a dump filled at once (one column at a time, so they should fit in the cache)
+CHUNK_ROWS = 4096
+
+def _bytes(src, size=None):
+	# the first size bytes of src (all of them with None), as a buffer hexlify accepts
+	# without copying it first
+	view = memoryview(src)
+	return view if size is None else view[:size]
+
+def spacedHex(src, size=None, trailing=False):
+	"""Return the bytes of src in uppercase hex, separated by spaces: '0A 1B 2C' (with
+	trailing, every byte is followed by a space, the last one too)"""
+	digits = binascii.hexlify(_bytes(src, size)).translate(UPPER)
+	spaced = bytearray(' ' * (len(digits) // 2 * 3))
+	spaced[0::3] = digits[0::2]
+	spaced[1::3] = digits[1::2]
+	return str(spaced) if trailing else str(spaced[:-1])
+
+def _hexRows(digits, text, first, end, length, offset, offsetDigits):
+	# rows first to end (all full) of a dump whose offsets have offsetDigits digits: they
+	# all have the same width, so each column of the rows is filled at once, from a slice
+	# of the hex digits, of the characters or of the hex of the offsets
+	count = end - first
+	width = offsetDigits + length * 4 + 7
+	rows = bytearray(' ') * (count * width)
+	rows[width - 1::width] = '\n' * count
+
+	values = array.array('L', range(offset + first * length, offset + end * length, length))
+	if sys.byteorder == 'little':
+		values.byteswap()
+	offsets = binascii.hexlify(values.tostring()).translate(UPPER)
+	size = values.itemsize * 2
+	for i in xrange(offsetDigits):
+		rows[i::width] = offsets[size - offsetDigits + i::size]
+
+	column = offsetDigits + 3
+	for i in xrange(length * 2):
+		rows[column + i // 2 * 3 + i % 2::width] = digits[first * length * 2 + i:end * length * 2:length * 2]
+	column += length * 3 + 3
+	for i in xrange(length):
+		rows[column + i::width] = text[first * length + i:end * length:length]
+	return str(rows)
+
+def dump(src, length=8, limit=10000, offset=0, offsetDigits=4):
+	"""Return the hex dump of src, length bytes per row: offset (of the row in src, plus
+	offset), hex bytes and printable characters. The dump stops after the row that makes
+	it longer than limit characters (None for no limit)."""
+	size = len(src)
+	if limit is not None:
+		# no row is shorter than this, so the bytes after these are never shown
+		size = min(size, (limit // (length * 4 + offsetDigits + 7) + 1) * length)
+	width = length * 3
+
+	def rowWidth(row):
+		# offset, '   ', hex, '   ', text and newline
+		return len('%0*X' % (offsetDigits, offset + row * length)) + width + min(length, size - row * length) + 7
+
+	limited = False
+	if limit is not None:
+		total = 0
+		for row in xrange((size + length - 1) // length):
+			total += rowWidth(row)
+			if total > limit:
+				size = min(size, (row + 1) * length)
+				limited = True
+				break
+
+	data = _bytes(src, size).tobytes()
+	digits = binascii.hexlify(data).translate(UPPER)
+	text = data.translate(FILTER)
+
+	# the full rows, in runs of offsets of the same number of digits
+	parts = []
+	rows = size // length
+	first = 0
+	runDigits = offsetDigits
+	while first < rows:
+		if offset + first * length >= 16 ** runDigits:
+			runDigits += 1
+			continue
+		end = min(rows, first + CHUNK_ROWS, (16 ** runDigits - offset + length - 1) // length)
+		parts.append(_hexRows(digits, text, first, end, length, offset, runDigits))
+		first = end
+	if size % length:
+		parts.append('%0*X   %s   %s\n' % (offsetDigits, offset + rows * length,
+			spacedHex(data[rows * length:], None, True).ljust(width), text[rows * length:]))
+	if limited:
+		parts.append('(analysis limit reached after %i bytes)' % limit)
+	return ''.join(parts)
+
+def hex2nums(src, length=8):
+	"""Return the bytes of src in hex, separated by spaces"""
+	return spacedHex(src)
+
+def hex2string(src, length=8):
+	"""Return the printable characters of src, with dots for the others"""
+	return _bytes(src).tobytes().translate(FILTER)
+
+if __name__ == '__main__':
+	# microbenchmark: dump of 1 MB of random data, compared with the byte at a time
+	# formatting this module replaced (on 64 KB, it is quadratic)
+	import os
+
+	def byteDump(src, length=8, limit=10000):
+		N = 0
+		result = ''
+		while src:
+			s, src = src[:length], src[length:]
+			hexa = ' '.join(['%02X' % ord(x) for x in s])
+			s = s.translate(FILTER)
+			result += '%04X   %-*s   %s\n' % (N, length * 3, hexa, s)
+			N += length
+			if (len(result) > limit):
+				src = ''
+				result += '(analysis limit reached after %i bytes)' % limit
+		return result
+
+	size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024 * 1024
+	data = os.urandom(size)
+
+	small = data[:65536]
+	assert dump(small, 16, None) == byteDump(small, 16, sys.maxint)
+	assert dump(small, 16, 10000) == byteDump(small, 16, 10000)
+	assert dump(small, 8) == byteDump(small, 8)
+	assert hex2nums(small) == ' '.join(['%02X' % ord(x) for x in small])
+	assert dump(small, 16, None, 0xFFF0, 4) == ''.join(['%04X%s' % (0xFFF0 + int(row[:4], 16), row[4:])
+		for row in byteDump(small, 16, sys.maxint).splitlines(True)])
+
+	start = time.time()
+	byteDump(small, 16, sys.maxint)
+	print 'byte at a time, %i KB: %.1f ms' % (len(small) // 1024, (time.time() - start) * 1000)
+
+	for name, function in (('dump', lambda: dump(data, 16, None)), ('hex2nums', lambda: hex2nums(data)),
+			('hex2string', lambda: hex2string(data))):
+		start = time.time()
+		function()
+		print '%s, %i KB: %.1f ms' % (name, size // 1024, (time.time() - start) * 1000)
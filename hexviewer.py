@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+ Paged hex viewer for iPBA
+
+ The file is memory mapped and only the bytes of the page shown are read and formatted,
+ so showing a page in the middle of a large file is as fast as showing the first one.
+'''
+
+import os
+import re
+import mmap
+import hexformat
+
+_offsetPattern = re.compile(r'^\s*(?:(0x)([0-9a-f]+)|([0-9a-f]+)h|([0-9]+))\s*$', re.IGNORECASE)
+
+def parseOffset(text):
+	"""Return the offset written in text, in decimal or in hex (0x1F00 or 1F00h), or None"""
+	match = _offsetPattern.match(text)
+	if match is None:
+		return None
+	prefixed, prefixedHex, suffixedHex, decimal = match.groups()
+	if decimal is not None:
+		return int(decimal)
+	return int(prefixedHex if prefixed else suffixedHex, 16)
+
+class HexViewer(object):
+	def __init__(self, filename, width=16, lines=256):
+		"""Show the file as hex dump pages of the given number of lines of width bytes,
+		starting from the first page"""
+		self.filename = filename
+		self.width = width
+		self.pageSize = width * lines
+		self.offset = 0
+
+		self._file = open(filename, 'rb')
+		try:
+			self.size = os.fstat(self._file.fileno()).st_size
+			# an empty file can not be mapped
+			if self.size:
+				self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+			else:
+				self._data = ''
+		except:
+			self._file.close()
+			raise
+
+	def close(self):
+		if self.size:
+			self._data.close()
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def pageCount(self):
+		return max(1, (self.size + self.pageSize - 1) // self.pageSize)
+
+	def pageNumber(self):
+		"""Number (from 0) of the page holding the first byte shown"""
+		return self.offset // self.pageSize
+
+	def page(self):
+		"""Return the hex dump of the current page"""
+		return hexformat.dump(self._data[self.offset:self.offset + self.pageSize], self.width, None, self.offset, 8)
+
+	def goto(self, offset):
+		"""Show the page starting with the line holding offset (clamped to the file), return it"""
+		offset = max(0, min(offset, self.size - 1))
+		self.offset = offset - offset % self.width
+		return self.page()
+
+	def nextPage(self):
+		if self.offset + self.pageSize < self.size:
+			self.offset += self.pageSize
+		return self.page()
+
+	def previousPage(self):
+		self.offset = max(0, self.offset - self.pageSize)
+		return self.page()
+
+	def status(self):
+		"""Describe the position of the current page in the file"""
+		return 'Page %i of %i, bytes %i-%i of %i' % (self.pageNumber() + 1, self.pageCount(),
+			self.offset, min(self.offset + self.pageSize, self.size), self.size)
@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+ Integrity verification of an iPhone backup for iPBA
+
+ Every regular file of the manifest is hashed (SHA-1, in blocks) and compared with the
+ datahash of its record. The files are hashed by a pool of threads: file reads and
+ hashlib release the interpreter lock, so several files are read at once and the disk,
+ not a single Python thread, sets the pace.
+
+ Progress is saved to a JSON checkpoint file, from which an interrupted run resumes.
+'''
+
+import os
+import sys
+import time
+import json
+import errno
+import getopt
+import functools
+from multiprocessing.pool import ThreadPool
+
+import hashutils
+import manifestmbdb
+
+class IntegrityReport(object):
+	"""Result of the verification of a backup: the status and SHA-1 of each file verified
+	(by fileid), the files of the backup directory that no record refers to, and the
+	number of bytes hashed and the time spent doing it"""
+
+	# status of a file
+	OK = u'ok'
+	MISMATCHED = u'mismatched'
+	MISSING = u'missing'
+	UNREADABLE = u'unreadable'
+	# the record has no datahash, the file is only checked for existence
+	UNVERIFIABLE = u'unverifiable'
+
+	def __init__(self):
+		self.results = {}
+		self.unreferenced = []
+		self.bytes = 0
+		self.elapsed = 0.0
+
+	def filesWithStatus(self, status):
+		return sorted(fileid for fileid, (fileStatus, sha1) in self.results.iteritems() if fileStatus == status)
+
+	def throughput(self):
+		"""Bytes hashed per second"""
+		return self.bytes / self.elapsed if self.elapsed else 0.0
+
+	def passed(self):
+		return not any(status in (self.MISMATCHED, self.MISSING, self.UNREADABLE) for status, sha1 in self.results.itervalues())
+
+	def __str__(self):
+		counts = dict((status, len(self.filesWithStatus(status))) for status in
+			(self.OK, self.MISMATCHED, self.MISSING, self.UNREADABLE, self.UNVERIFIABLE))
+		return '\n'.join([
+			'Files verified: %i' % len(self.results),
+			'  ok: %(ok)i' % counts,
+			'  mismatched: %(mismatched)i' % counts,
+			'  missing: %(missing)i' % counts,
+			'  unreadable: %(unreadable)i' % counts,
+			'  without datahash: %(unverifiable)i' % counts,
+			'Unreferenced files: %i' % len(self.unreferenced),
+			'Hashed %.1f MB in %.1f s (%.1f MB/s)' % (self.bytes / 1048576.0, self.elapsed, self.throughput() / 1048576.0),
+		])
+
+def _verifyFile(backupPath, blockSize, item):
+	# runs in the threads of the pool: returns (fileid, status, sha1, bytes hashed)
+	fileid, datahash = item
+	try:
+		if not datahash:
+			os.stat(os.path.join(backupPath, fileid))
+			return fileid, IntegrityReport.UNVERIFIABLE, None, 0
+		sha1 = hashutils.hashFile(os.path.join(backupPath, fileid), ('sha1',), blockSize)['sha1']
+		size = os.path.getsize(os.path.join(backupPath, fileid))
+	except EnvironmentError as e:
+		if e.errno == errno.ENOENT:
+			return fileid, IntegrityReport.MISSING, None, 0
+		return fileid, IntegrityReport.UNREADABLE, None, 0
+	if sha1 != datahash:
+		return fileid, IntegrityReport.MISMATCHED, sha1, size
+	return fileid, IntegrityReport.OK, sha1, size
+
+class IntegrityChecker(object):
+	# files of the backup directory which are not described by the manifest
+	metadataFiles = frozenset([u'Manifest.mbdb', u'Manifest.mbdx', u'Manifest.plist', u'Info.plist', u'Status.plist'])
+
+	def __init__(self, mbdb, threads=4, checkpoint=None, checkpointInterval=10.0, blockSize=hashutils.blockSize):
+		"""Verify the files of the backup of the given ManifestMBDB with a pool of threads.
+
+		If checkpoint is the name of a file, the results are saved to it every
+		checkpointInterval seconds (and when the run is interrupted), and a later run of
+		the same manifest only verifies the files not yet in it. It is removed once all the
+		files are verified.
+		"""
+		self.mbdb = mbdb
+		self.backupPath = os.path.dirname(mbdb.fname)
+		self.threads = threads
+		self.checkpoint = checkpoint
+		self.checkpointInterval = checkpointInterval
+		self.blockSize = blockSize
+
+	def _manifest(self):
+		info = os.stat(self.mbdb.fname)
+		return [os.path.abspath(self.mbdb.fname), info.st_size, info.st_mtime]
+
+	def loadCheckpoint(self):
+		"""Return the report saved in the checkpoint file, or None if there is none (or it
+		was saved for another version of the manifest)"""
+		if not self.checkpoint or not os.path.exists(self.checkpoint):
+			return None
+		with open(self.checkpoint, 'rb') as f:
+			state = json.load(f)
+		if state.get(u'manifest') != self._manifest():
+			return None
+		report = IntegrityReport()
+		report.results = dict((fileid, tuple(result)) for fileid, result in state[u'results'].iteritems())
+		report.bytes = state[u'bytes']
+		report.elapsed = state[u'elapsed']
+		return report
+
+	def saveCheckpoint(self, report):
+		# written aside and renamed, so that an interruption never leaves half a checkpoint
+		state = {
+			u'manifest': self._manifest(),
+			u'results': report.results,
+			u'bytes': report.bytes,
+			u'elapsed': report.elapsed,
+		}
+		temporary = self.checkpoint + '.tmp'
+		with open(temporary, 'wb') as f:
+			json.dump(state, f)
+		if os.name == 'nt' and os.path.exists(self.checkpoint):
+			os.remove(self.checkpoint)
+		os.rename(temporary, self.checkpoint)
+
+	def unreferencedFiles(self, fileIds):
+		"""Return the names of the files of the backup directory no record refers to"""
+		ignored = set(self.metadataFiles)
+		if self.checkpoint:
+			ignored.update(os.path.basename(name) for name in (self.checkpoint, self.checkpoint + '.tmp'))
+		return sorted(name for name in os.listdir(self.backupPath)
+			if name not in fileIds and name not in ignored and os.path.isfile(os.path.join(self.backupPath, name)))
+
+	def verify(self, progress=None):
+		"""Verify the files, return an IntegrityReport. progress, if given, is called with
+		the report after each file."""
+		fileIds = self.mbdb.fileIdMap()
+		report = self.loadCheckpoint() or IntegrityReport()
+		pending = [(fileid, datahash) for fileid, (fileType, datahash) in sorted(fileIds.iteritems())
+			if fileType == u'-' and fileid not in report.results]
+
+		start = time.time() - report.elapsed
+		lastCheckpoint = time.time()
+		pool = ThreadPool(self.threads)
+		try:
+			verifyFile = functools.partial(_verifyFile, self.backupPath, self.blockSize)
+			for fileid, status, sha1, size in pool.imap_unordered(verifyFile, pending, 8):
+				report.results[fileid] = (status, sha1)
+				report.bytes += size
+				report.elapsed = time.time() - start
+				if progress is not None:
+					progress(report)
+				if self.checkpoint and time.time() - lastCheckpoint >= self.checkpointInterval:
+					self.saveCheckpoint(report)
+					lastCheckpoint = time.time()
+			pool.close()
+		except:
+			if self.checkpoint:
+				self.saveCheckpoint(report)
+			raise
+		finally:
+			pool.terminate()
+			pool.join()
+
+		if self.checkpoint and os.path.exists(self.checkpoint):
+			os.remove(self.checkpoint)
+		report.unreferenced = self.unreferencedFiles(fileIds)
+		return report
+
+if __name__ == '__main__':
+
+	def usage():
+		print "\nUsage:\n"
+		print "Verify the files of a backup against the data hashes of its manifest:"
+		print " -t <threads> : number of files hashed at the same time (default 4)"
+		print " -c <file>    : checkpoint file, to resume an interrupted verification"
+		print "                (default integrity-<backup directory name>.json)"
+		print " -q           : do not show the progress"
+		print " -h           : this help\n"
+		print "integrity.py [options] <backup directory>\n"
+
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "ht:c:q")
+	except getopt.GetoptError as err:
+		print str(err)
+		usage()
+		sys.exit(2)
+
+	threads = 4
+	checkpoint = None
+	quiet = False
+	for o, a in opts:
+		if o in ("-h"):
+			usage()
+			sys.exit(0)
+		if o in ("-t"):
+			threads = int(a)
+		if o in ("-c"):
+			checkpoint = a
+		if o in ("-q"):
+			quiet = True
+
+	if len(args) != 1:
+		usage()
+		sys.exit(2)
+
+	backup_path = args[0]
+	if checkpoint is None:
+		checkpoint = 'integrity-%s.json' % os.path.basename(os.path.normpath(backup_path))
+
+	mbdb = manifestmbdb.ManifestMBDB(os.path.join(backup_path, 'Manifest.mbdb'))
+	checker = IntegrityChecker(mbdb, threads, checkpoint)
+
+	lastShown = [0.0]
+	def showProgress(report):
+		if time.time() - lastShown[0] >= 1.0:
+			sys.stderr.write('\r%i files, %.1f MB/s ' % (len(report.results), report.throughput() / 1048576.0))
+			lastShown[0] = time.time()
+
+	try:
+		report = checker.verify(None if quiet else showProgress)
+	except KeyboardInterrupt:
+		print "\nInterrupted, progress saved to %s" % checkpoint
+		sys.exit(3)
+	if not quiet:
+		sys.stderr.write('\n')
+
+	print report
+	for status in (IntegrityReport.MISMATCHED, IntegrityReport.MISSING, IntegrityReport.UNREADABLE):
+		for fileid in report.filesWithStatus(status):
+			print '%s: %s' % (status, fileid)
+	for name in report.unreferenced:
+		print 'unreferenced: %s' % name
+
+	sys.exit(0 if report.passed() else 1)
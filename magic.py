@@ -18,7 +18,7 @@ magic.py
                            'filename' contains.
 '''
 
-import re, struct, string
+import re, struct, string, os, sys, marshal
 
 __version__ = '0.1'
 
@@ -883,7 +883,18 @@ magic = [
   [0L, 'string', '=', 'ZyXEL\002', 'ZyXEL voice data'],
 ]
 
+# magicTest objects of the table above (built on first use, see tests()) followed
+# by the ones read by load()
 magicNumbers = []
+builtTests = False
+
+def tests():
+  """ returns magicNumbers, building the tests of the table if they are not there yet """
+  global builtTests
+  if not builtTests:
+    builtTests = True
+    magicNumbers[0:0] = [magicTest(m[0], m[1], m[2], m[3], m[4]) for m in magic]
+  return magicNumbers
 
 def strToNum(n):
   val = 0
@@ -1007,7 +1018,9 @@ class magicTest:
     
 
 def load(file):
-  global magicNumbers
+  global compiled
+  tests()
+  compiled = None
   lines = open(file).readlines()
   last = { 0: None }
   for line in lines:
@@ -1074,10 +1087,182 @@ def load(file):
         last[level] = new
         l.append(new)
 
+# compiled form of magicNumbers, used by whatis --------------------------------
+
+# how magicTest.compare reads each numeric type (the others never match)
+numericFormats = {
+  'short': 'h', 'leshort': '<h', 'beshort': '>H',
+  'long': 'l', 'lelong': '<l', 'belong': '>l',
+}
+numericWidths = { 'short': 2, 'leshort': 2, 'beshort': 2, 'long': 4, 'lelong': 4, 'belong': 4 }
+
+# returned by compiledMagic.match when the data is too short to decide
+incomplete = object()
+
+class compiledMagic:
+  """ the tests of magicNumbers grouped by what they read: the same (offset, type,
+      mask) for numbers, the same (offset, length) for strings. each field is read
+      once, and the values of the group are matched with a dict lookup. match()
+      returns the message of the first test in magicNumbers order that matches,
+      exactly as calling compare() on each test would. extent is the number of
+      bytes match() may need to look at """
+
+  def __init__(self, tests = None, state = None):
+    if state is not None:
+      self.setState(state)
+      return
+    self.count = len(tests)
+    self.msgs = []
+    groups = {}
+    for index, test in enumerate(tests):
+      self.msgs.append(test.msg)
+      # only '=' tests with a message can match
+      if test.op != '=' or not test.msg: continue
+      if test.type == 'string':
+        key = (test.offset, len(test.value), None, None)
+      elif test.type in numericFormats:
+        fmt = struct.Struct(numericFormats[test.type])
+        # e.g. native longs are 8 bytes on 64 bit platforms: they can't be
+        # unpacked from the 4 bytes compare() reads
+        if fmt.size != numericWidths[test.type]: continue
+        key = (test.offset, fmt.size, fmt.format, test.mask)
+      else:
+        continue
+      values = groups.setdefault(key, {})
+      if test.value not in values:
+        values[test.value] = index
+
+    # (first test index, offset, end, struct or None for strings, mask, values)
+    self.groups = []
+    for (offset, length, fmt, mask), values in groups.items():
+      if fmt is not None: fmt = struct.Struct(fmt)
+      self.groups.append((min(values.values()), offset, offset + length, fmt, mask, values))
+    self.groups.sort()
+    # compare() reads one char more than the string length
+    self.extent = max([end + (fmt is None) for first, offset, end, fmt, mask, values in self.groups] or [0])
+
+  def getState(self):
+    """ the matcher as plain data, that marshal can store """
+    groups = [(first, offset, end, fmt and fmt.format, mask, values)
+      for first, offset, end, fmt, mask, values in self.groups]
+    return (self.count, self.msgs, groups, self.extent)
+
+  def setState(self, state):
+    self.count, self.msgs, groups, self.extent = state
+    self.groups = [(first, offset, end, fmt and struct.Struct(fmt), mask, values)
+      for first, offset, end, fmt, mask, values in groups]
+
+  def match(self, data, complete=True):
+    """ with complete False, data is only the beginning of the file: incomplete is
+        returned if the result depends on what follows """
+    best = None
+    size = len(data)
+    for first, offset, end, fmt, mask, values in self.groups:
+      # the groups are sorted by their first test
+      if best is not None and first >= best: break
+      if fmt is None:
+        # compare() reads one char more than the string length
+        if size <= end:
+          if not complete: return incomplete
+          continue
+        index = values.get(data[offset:end])
+      else:
+        if size < end:
+          if not complete: return incomplete
+          continue
+        [value] = fmt.unpack(data[offset:end])
+        if mask: value = value & mask
+        index = values.get(value)
+      if index is not None and (best is None or index < best):
+        best = index
+    if best is None: return None
+    return self.msgs[best]
+
+compiled = None
+
+def userCacheDir():
+  # where the platform keeps the caches of the user's programs
+  if sys.platform == 'darwin':
+    base = os.path.expanduser(os.path.join('~', 'Library', 'Caches'))
+  elif sys.platform == 'win32':
+    base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+  else:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache'))
+  return os.path.join(base, 'ipba')
+
+# the compiled table is saved here, and reused until magic.py changes (None: no cache)
+cacheFile = os.path.join(userCacheDir(), 'magic.cache')
+
+def saveCache(key, state):
+  # written to a temporary file of its own then renamed, so that concurrent runs never
+  # read or write a partial cache; when the directory is not writable there is no cache
+  import tempfile
+  directory = os.path.dirname(cacheFile)
+  try:
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(prefix = 'magic.cache.', dir = directory)
+  except (IOError, OSError):
+    return
+  try:
+    f = os.fdopen(fd, 'wb')
+    try:
+      marshal.dump((key, state), f)
+    finally:
+      f.close()
+    os.rename(tmp, cacheFile)
+  except (IOError, OSError):
+    try:
+      os.remove(tmp)
+    except OSError:
+      pass
+
+def cacheKey():
+  # the compiled tests depend on the table, on the platform (struct sizes) and
+  # on the marshal format
+  source = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+  st = os.stat(source)
+  return (st.st_size, repr(st.st_mtime), sys.version, struct.calcsize('l'), marshal.version)
+
+def compiledTests():
+  """ returns the compiled matcher of magicNumbers: when they are only the tests
+      of the table, it is read from cacheFile (and written there the first time,
+      in the user's cache directory) """
+  global compiled
+  if compiled is not None and (not magicNumbers or compiled.count == len(magicNumbers)):
+    return compiled
+
+  if magicNumbers:
+    compiled = compiledMagic(magicNumbers)
+    return compiled
+
+  key = None
+  if cacheFile:
+    try:
+      key = cacheKey()
+    except OSError:
+      pass
+  if key is not None:
+    try:
+      f = open(cacheFile, 'rb')
+      try:
+        cachedKey, state = marshal.load(f)
+      finally:
+        f.close()
+      if cachedKey == key:
+        compiled = compiledMagic(state = state)
+        return compiled
+    except (IOError, EOFError, ValueError, TypeError):
+      pass
+
+  compiled = compiledMagic(tests())
+  if key is not None:
+    saveCache(key, compiled.getState())
+  return compiled
+
 def whatis(data):
-  for test in magicNumbers:
-     m = test.compare(data)
-     if m: return m
+  m = compiledTests().match(data)
+  if m: return m
   # no matching, magic number. is it binary or text?
   for c in data:
     if ord(c) > 128:
@@ -1090,9 +1275,51 @@ def whatis(data):
   return 'ASCII text'
       
     
+# the text tests of whatis look at this much data
+textExtent = 8192
+
+def sniff(fh, firstRead = 512):
+  """ reads from the open file fh only as much as whatis needs to identify it:
+      returns the description and the data read """
+  data = fh.read(firstRead)
+  complete = len(data) < firstRead
+  m = compiledTests().match(data, complete)
+  if m is incomplete:
+    data = data + fh.read(compiled.extent - len(data))
+    complete = len(data) < compiled.extent
+    m = compiled.match(data, complete)
+  if m: return m, data
+  # no magic number: the text tests need more
+  if not complete and len(data) < textExtent:
+    data = data + fh.read(textExtent - len(data))
+  return whatis(data[:textExtent]), data
+
+def probe(filename, headerSize = 30, hashNames = ('md5',), blockSize = 1024*1024):
+  """ identifies the file, reads its first headerSize bytes and hashes its whole
+      content (with the hashlib algorithms in hashNames), opening and reading it
+      only once: returns (description, header, { hash name: hex digest }); with no
+      hashNames only the beginning of the file is read """
+  import hashutils
+  fh = open(filename, 'rb')
+  try:
+    m, data = sniff(fh, max(headerSize, 512))
+    if len(data) < headerSize:
+      data = data + fh.read(headerSize - len(data))
+    header = data[:headerSize]
+    hashes = {}
+    if hashNames:
+      hashes = hashutils.hashStream(fh, hashNames, blockSize, data)
+  finally:
+    fh.close()
+  return m, header, hashes
+
 def file(file):
   try:
-    return whatis(open(file, 'r').read(8192))
+    fh = open(file, 'r')
+    try:
+      return sniff(fh)[0]
+    finally:
+      fh.close()
   except Exception, e:
     if str(e) == '[Errno 21] Is a directory':
       return 'directory'
@@ -1107,10 +1334,6 @@ def file(file):
 #  f.write(str([m.offset, m.type, m.op, m.value, m.msg]) + ',\n')
 #f.close
 
-import sys
-for m in magic:
-  magicNumbers.append(magicTest(m[0], m[1], m[2], m[3], m[4]))
-
 if __name__ == '__main__':
   import sys
   for arg in sys.argv[1:]:
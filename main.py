@@ -38,8 +38,6 @@ import Tkinter, ttk
 import tkFileDialog, tkMessageBox
 # datetime used to convert unix timestamps
 from datetime import datetime
-# hashlib used to build md5s ans sha1s of files
-import hashlib
 # binascci used to try to convert binary data in ASCII
 import binascii
 # getopt used to parse command line options
@@ -57,6 +55,8 @@ import base64
 import string
 # to open external file viewers
 import subprocess
+# the manifest is loaded by a worker thread, which reports to the UI through a queue
+import threading, Queue
 
 # APPLICATION FILES IMPORTS -------------------------------------------------------------------------
 
@@ -64,8 +64,16 @@ import subprocess
 import magic
 # mbdbdecoding.py - functions to decode iPhone backup manifest files
 import mbdbdecoding
+# hexviewer.py - paged hex dump of memory mapped files
+import hexviewer
+# textviewer.py - paged view of memory mapped text files
+import textviewer
+# hexformat.py - hex dumps of binary data
+from hexformat import dump, hex2nums, hex2string
 # plistutils.py - generic functions to handle plist files
 import plistutils
+# hashutils.py - streaming md5 and sha1 hashes of files
+import hashutils
 # manifestmbdb.py - handlees the decoding of the manifest.mbdb file, as well as 
 #                   the creation of a database for convienient searching
 import manifestmbdb as MBDB
@@ -83,6 +91,12 @@ backup_path = ''
 # (to keep them alive after callback end)
 photoImages = []
 
+# the file of the "Hex view" tab, and its hexviewer.HexViewer (opened when the tab is shown)
+hexFile = None
+hexViewer = None
+# the textviewer.TextViewer of the text file shown in the "Text view" tab
+textViewer = None
+
 # limits the display of rows dumped from a table
 rowsoffset = 0
 rowsnumber = 100
@@ -120,60 +134,6 @@ def autoscroll(sbar, first, last):
         sbar.grid()
     sbar.set(first, last)
 	
-def md5(md5fileName, excludeLine='', includeLine=''):
-	"""Compute md5 hash of the specified file"""
-	m = hashlib.md5()
-	try:
-		fd = open(md5fileName,'rb')
-	except IOError:
-		return '<none>'
-	content = fd.readlines()
-	fd.close()
-	for eachLine in content:
-		if excludeLine and eachLine.startswith(excludeLine):
-			continue
-		m.update(eachLine)
-	m.update(includeLine)
-	return m.hexdigest()
-
-FILTER=''.join([(len(repr(chr(x)))==3) and chr(x) or '.' for x in range(256)])
-
-def dump(src, length=8, limit=10000):
-	N=0
-	result=''
-	while src:
-		s,src = src[:length],src[length:]
-		hexa = ' '.join(['%02X' % ord(x) for x in s])
-		s = s.translate(FILTER)
-		result += '%04X   %-*s   %s\n' % (N, length*3, hexa, s)
-		N += length
-		if (len(result) > limit):
-			src = '';
-			result += '(analysis limit reached after %i bytes)' % limit
-	return result
-
-def hex2string(src, length=8):
-	N=0
-	result=''
-	while src:
-		s,src = src[:length],src[length:]
-		hexa = ' '.join(['%02X' % ord(x) for x in s])
-		s = s.translate(FILTER)
-		N += length
-		result += s
-	return result	
-
-def hex2nums(src, length=8):
-	N = 0
-	result = []
-	while src:
-		s,src = src[:length],src[length:]
-		hexa = ' '.join(['%02X' % ord(x) for x in s])
-		s = s.translate(FILTER)
-		N += length
-		result.append(hexa)
-	return ' '.join(result)
-    
 def log(text):
 	logbox.insert(END, "\n%s"%text)
 	logbox.yview(END)
@@ -184,22 +144,215 @@ def maintext(text):
 def clearmaintext():
 	textarea.delete(1.0, END)
 	
-# scans the main tree view and returns the code of the node with a specified ID
-# (by the way, the ID is the index of the element in the index database)
-def searchIndexInTree(index, parent=''):
-	#print("---- searching under node: %s"%(tree.item(parent)['text']))
-	for node in tree.get_children(parent):			
-		#print("node under exam: %s - %s"%(node,tree.item(node)['text']))
-		id = tree.set(node, 'id')
-		#print("Confronto id %s con %s"%(id, index))
-		if (id):
-			if (int(id) == int(index)): 
-				#print("found!")
-				return node			
-		sottonodi = searchIndexInTree(index, node)
-		if (sottonodi is not None):
-			return sottonodi	
-	return
+# lazy population of the main tree view: nodes whose children have not been inserted yet
+# hold a single placeholder child (so that they can be expanded) and are listed here, with
+# what they contain: (domain type,), (domain type, domain) or (domain type, domain, path)
+lazyNodes = {}
+
+# for each (domain type, domain) already listed: the paths holding at least a file, and
+# the directories with a record of their own (whose content is shown under that record)
+domainPaths = {}
+
+# the item showing each of the contents above, and the item of each file id, for the
+# items inserted so far (see treeItemOfFile)
+contentItems = {}
+fileItems = {}
+
+# while the manifest is loading, the (domain type, domain) whose records are all stored,
+# the only ones listed so far (see addDomain); None once it is loaded
+loadedDomains = set()
+
+def fileDimension(file_len):
+	if (file_len) < 1024:
+		return unicode(file_len) + u' B'
+	else:
+		return unicode(file_len / 1024) + u' KiB'
+
+def fileValues(f):
+	return (f['type'], fileDimension(f['filelen']), f['id'])
+
+def addPlaceholder(node, content):
+	lazyNodes[node] = content
+	contentItems[content] = node
+	tree.insert(node, 'end', text='...', tag='base')
+
+def addDomainType(domain_type):
+	"""Insert a domain type in the main tree view (its content is inserted when expanded)"""
+	domain_type_index = tree.insert('', 'end', text=domain_type, tag='base')
+	addPlaceholder(domain_type_index, (domain_type,))
+
+def addDomain(domain_type, domain_name):
+	"""Show a domain whose records have all been stored, while the manifest is loading"""
+	content = (domain_type, domain_name)
+	reported = content in loadedDomains
+	loadedDomains.add(content)
+	node = contentItems.get((domain_type,))
+	if node is None:
+		addDomainType(domain_type)
+	elif node in lazyNodes:
+		# it is listed when the domain type is expanded
+		pass
+	elif domain_name and not reported:
+		domain_name_index = tree.insert(node, 'end', text=domain_name, tag='base')
+		addPlaceholder(domain_name_index, content)
+	else:
+		# the domain without a name is shown in the domain type item, and a domain reported
+		# again has more records: the items are inserted again when it is expanded
+		resetDomainType(node, domain_type)
+
+def resetDomainType(node, domain_type):
+	"""Remove the items under a domain type item, which becomes lazy again"""
+	removed = set()
+	pending = list(tree.get_children(node))
+	while pending:
+		item = pending.pop()
+		removed.add(item)
+		pending.extend(tree.get_children(item))
+	removed.add(node)
+
+	for item in removed:
+		lazyNodes.pop(item, None)
+	for content in [c for c, item in contentItems.items() if item in removed and len(c) > 1]:
+		del contentItems[content]
+	for content in [c for c in domainPaths if c[0] == domain_type]:
+		del domainPaths[content]
+	for fileid in [f for f, item in fileItems.items() if item in removed]:
+		del fileItems[fileid]
+
+	tree.delete(*tree.get_children(node))
+	tree.item(node, values=(), open=False)
+	addPlaceholder(node, (domain_type,))
+
+def populateNode(node):
+	"""Insert the children of a node of the main tree, if they are not there yet"""
+	content = lazyNodes.pop(node, None)
+	if content is None:
+		return
+	tree.delete(*tree.get_children(node))
+	if len(content) == 1:
+		populateDomainType(node, *content)
+	elif len(content) == 2:
+		populateDomain(node, *content)
+	else:
+		populatePath(node, *content)
+
+def populateDomainType(node, domain_type):
+	for domain_name in mbdb.domainTypeMembers(domain_type):
+		if loadedDomains is not None and (domain_type, domain_name) not in loadedDomains:
+			# still being stored, it is inserted once complete (see addDomain)
+			continue
+		if domain_name:
+			domain_name_index = tree.insert(node, 'end', text=domain_name, tag='base')
+			addPlaceholder(domain_name_index, (domain_type, domain_name))
+		else:
+			contentItems[(domain_type, domain_name)] = node
+			populateDomain(node, domain_type, domain_name)
+
+def populateDomain(node, domain_type, domain_name):
+	paths = mbdb.filePathsOfDomain(domain_type, domain_name)
+	directories = mbdb.directoriesOfDomain(domain_type, domain_name)
+	domainPaths[(domain_type, domain_name)] = (set(paths), directories)
+
+	contentItems[(domain_type, domain_name, u'')] = node
+	populatePath(node, domain_type, domain_name, u'')
+	
+	# paths without a directory record are listed directly under the domain
+	for path in paths:
+		if path and path not in directories:
+			path_index = tree.insert(node, 'end', text=path, tag='base')
+			addPlaceholder(path_index, (domain_type, domain_name, path))
+
+def populatePath(node, domain_type, domain_name, path):
+	paths, directories = domainPaths[(domain_type, domain_name)]
+	
+	for f in mbdb.filesInDir(domain_type, domain_name, path):
+		file_name = f['file_name']
+
+		if file_name:
+			file_index = tree.insert(node, 'end', text=file_name, values=fileValues(f), tag='base')
+			fileItems[f['id']] = file_index
+			if f['type'] == u'd':
+				dir_path = u'/'.join([path, file_name]) if path else file_name
+				if dir_path in paths:
+					addPlaceholder(file_index, (domain_type, domain_name, dir_path))
+		else:
+			tree.item(node, values=fileValues(f))
+			fileItems[f['id']] = node
+
+def insertTreeNode(parent, tree_node, domain_type=None, domain_name=u''):
+	"""Insert a node of ManifestMBDB.fileTree, and all the nodes under it, opened"""
+	values = ()
+	if tree_node.record is not None:
+		values = fileValues(tree_node.record)
+	index = tree.insert(parent, 'end', text=tree_node.name, values=values, open=True, tag='base')
+	if tree_node.record is not None:
+		fileItems[tree_node.record['id']] = index
+
+	if tree_node.kind == MBDB.ManifestTreeNode.DOMAIN_TYPE:
+		domain_type = tree_node.name
+		contentItems[(domain_type,)] = index
+		contentItems[(domain_type, u'')] = contentItems[(domain_type, u'', u'')] = index
+	elif tree_node.kind == MBDB.ManifestTreeNode.DOMAIN:
+		domain_name = tree_node.name
+		contentItems[(domain_type, domain_name)] = contentItems[(domain_type, domain_name, u'')] = index
+	elif tree_node.kind == MBDB.ManifestTreeNode.PATH:
+		contentItems[(domain_type, domain_name, tree_node.name)] = index
+	elif tree_node.children:
+		f = tree_node.record
+		dir_path = u'/'.join([f['file_path'], f['file_name']]) if f['file_path'] else f['file_name']
+		contentItems[(domain_type, domain_name, dir_path)] = index
+
+	for child in tree_node.children:
+		insertTreeNode(index, child, domain_type, domain_name)
+
+def expandAll():
+	"""Insert and open all the nodes of the main tree, read with a single query"""
+	if not manifestLoaded():
+		return
+	for content, index in contentItems.items():
+		if len(content) == 1:
+			tree.delete(index)
+	lazyNodes.clear()
+	domainPaths.clear()
+	contentItems.clear()
+	fileItems.clear()
+	for domain_type in mbdb.fileTree().children:
+		insertTreeNode('', domain_type)
+
+def contentItem(content):
+	"""Return the item of the main tree view showing the given content (see lazyNodes),
+	inserting the items above it if they are not there yet; None if there is none"""
+	index = contentItems.get(content)
+	if index is not None or len(content) == 1:
+		return index
+
+	if len(content) == 2:
+		parent = contentItem(content[:1])
+	else:
+		# paths are listed under their domain, unless they have a directory record: then
+		# they are shown under that record, in the directory above
+		parent = contentItem(content[:2])
+		if parent is not None:
+			populateNode(parent)
+			index = contentItems.get(content)
+			if index is not None or not content[2]:
+				return index
+		parent = contentItem(content[:2] + (content[2].rpartition(u'/')[0],))
+	if parent is None:
+		return None
+	populateNode(parent)
+	return contentItems.get(content)
+
+# returns the item of the main tree view of the file with the given ID (the index of the
+# element in the index database), inserting the items above it if they are not there yet
+def treeItemOfFile(index):
+	index = int(index)
+	if index not in fileItems:
+		f = mbdb.fileInformation(index)
+		parent = contentItem((f['domain_type'], f['domain'], f['file_path']))
+		if parent is not None:
+			populateNode(parent)
+	return fileItems.get(index)
 	
 # Called when a button is clicked in the buttonbox (upper right) -----------------------------------------
 
@@ -328,18 +481,22 @@ if __name__ == '__main__':
  -d <dir>        : backup dir
  -s              : adapt main UI for small monitors (such as 7')
  -q <file>       : the name of the database file. if not specified, :memory: is used
+ -j <n>          : decode the manifest with n worker processes (0 for one per cpu)
+ -c <dir>        : keep the manifest database (and decoded plists) in a cache dir, reused until the backup changes
          iOS Version <= 4 not currently suppoted 
 ''')
 
 	# input parameters
 	try:
-		opts, args = getopt.getopt(sys.argv[1:], 'hd:sq:')
+		opts, args = getopt.getopt(sys.argv[1:], 'hd:sq:j:c:')
 	except getopt.GetoptError as err:
 		usage()
 		print('\n%s\n' % str(err))
 		sys.exit(2)
 	
 	database_file = ':memory:'
+	processes = 1
+	cache_dir = None
 	for o, a in opts:
 		if o in ("-h"):
 			usage()
@@ -356,6 +513,20 @@ if __name__ == '__main__':
 
 		if o in ('-q'):
 			database_file = a
+
+		if o in ('-j'):
+			try:
+				processes = int(a)
+			except ValueError:
+				processes = -1
+			if processes < 0:
+				usage()
+				print('\nThe number of processes must be a number, 0 or more.\n')
+				sys.exit(2)
+			processes = processes or None
+
+		if o in ('-c'):
+			cache_dir = a
 		
 
 	# show window to select directory
@@ -371,15 +542,19 @@ if __name__ == '__main__':
 	# decode Manifest files
 	mbdbPath = os.path.join(backup_path, 'Manifest.mbdb')
 	try:
-		mbdb = MBDB.ManifestMBDB(mbdbPath, db_file=database_file)
+		mbdb = MBDB.ManifestMBDB(mbdbPath, db_file=database_file, processes=processes, cache_dir=cache_dir, load=False)
 	except MBDB.ManifestMBDBError as e:
 		usage()
 		print('%s - are you sure this is a correct iOS backup dir?\n' % e)
 		sys.exit(1)
+
+	# decoded plists are kept next to the manifest database, in a directory of this backup
+	# (file ids are the same in every backup)
+	if cache_dir:
+		plistutils.plistCache.cacheDir = os.path.splitext(MBDB.cacheFileName(mbdbPath, cache_dir))[0] + '-plists'
 	
 	banner()
 	print("\nWorking directory: %s" % backup_path)
-	print("Read elements: %i" % len(mbdb))
 	
 	# Builds user interface ----------------------------------------------------------------------------------
 	
@@ -581,6 +756,18 @@ if __name__ == '__main__':
 	exifcolumn.grid_rowconfigure(0, weight=1)
 	notebook.add(exifcolumn, text='EXIF data')
 	notebook.hide(exifcolumn)
+	# hex view of the selected file, one page at a time
+	hexcolumn = ttk.Frame(notebook);
+	hexcolumn.grid_columnconfigure(0, weight=1)
+	hexcolumn.grid_rowconfigure(0, weight=1)
+	notebook.add(hexcolumn, text='Hex view')
+	notebook.hide(hexcolumn)
+	# text view of the selected text file, one page at a time
+	textcolumn = ttk.Frame(notebook);
+	textcolumn.grid_columnconfigure(0, weight=1)
+	textcolumn.grid_rowconfigure(0, weight=1)
+	notebook.add(textcolumn, text='Text view')
+	notebook.hide(textcolumn)
 		
 	notebook.grid(column = 2, row = 1, sticky="nsew")
 
@@ -655,6 +842,223 @@ if __name__ == '__main__':
 	fieldplus.bind('<Button-1>', recordplusbutton)
 	fieldplus.grid(column=2, row=0, sticky='nsew')
 
+	# hex view tab
+	hextext = Text(
+		hexcolumn, 
+		yscrollcommand=lambda f, l: autoscroll(hvsb, f, l),
+	    bd=2, 
+	    relief=SUNKEN, 
+	    font=('Courier', globalfont[1], 'normal'), 
+	    highlightbackground='lightblue'
+	)
+	hextext.grid(column=0, row=0, sticky="nsew")
+
+	hvsb = ttk.Scrollbar(hexcolumn, orient="vertical")
+	hvsb.grid(column=1, row=0, sticky='ns')
+	hvsb['command'] = hextext.yview
+
+	# block for moving between the pages of the hex view
+	hexblock = Frame(hexcolumn, bd=2, relief=RAISED, bg='#4d66fa');
+	hexblock.grid(column = 0, row = 1, sticky="nsew", columnspan=2)
+	hexblock.grid_columnconfigure(3, weight=1)
+
+	def showHexPage(page):
+		hextext.delete(1.0, END)
+		hextext.insert(END, page)
+		hexlabeltext.set(hexViewer.status())
+
+	def hexlessbutton(event):
+		if hexViewer is not None:
+			showHexPage(hexViewer.previousPage())
+
+	def hexplusbutton(event):
+		if hexViewer is not None:
+			showHexPage(hexViewer.nextPage())
+
+	def hexgotobutton(event):
+		if hexViewer is None:
+			return
+		offset = hexviewer.parseOffset(hexoffset.get())
+		if offset is None:
+			log("Invalid offset \"%s\": use a decimal number, or hex as 0x1F00 or 1F00h." % hexoffset.get())
+			return
+		showHexPage(hexViewer.goto(offset))
+
+	def showHexView():
+		# opens the file of the hex view and shows its first page, the first time it is
+		# needed; returns whether it could be opened
+		global hexFile, hexViewer
+		if hexViewer is None and hexFile is not None:
+			try:
+				hexViewer = hexviewer.HexViewer(hexFile)
+			except (EnvironmentError, ValueError) as e:
+				hextext.delete(1.0, END)
+				hextext.insert(END, "Unable to open the file for the hex view: %s" % e)
+				hexlabeltext.set("")
+				log("Unable to open %s for the hex view: %s" % (hexFile, e))
+				hexFile = None
+				return False
+			showHexPage(hexViewer.page())
+		return hexViewer is not None
+
+	def notebookTabChanged(event):
+		if str(notebook.select()) == str(hexcolumn):
+			showHexView()
+
+	notebook.bind("<<NotebookTabChanged>>", notebookTabChanged)
+
+	hexless = Button(
+		hexblock, 
+		text="<", 
+		width=10, 
+		default=ACTIVE, 
+		font=globalfont,
+		highlightbackground='#4d66fa'
+	)
+	hexless.bind("<Button-1>", hexlessbutton)
+	hexless.grid(column=0, row=0, sticky="nsew")
+
+	hexoffset = Entry(hexblock, width=12, font=globalfont)
+	hexoffset.bind("<Return>", hexgotobutton)
+	hexoffset.grid(column=1, row=0, sticky="nsew", padx=3, pady=3)
+
+	hexgoto = Button(
+		hexblock, 
+		text="Go to offset", 
+		default=ACTIVE, 
+		font=globalfont,
+		highlightbackground='#4d66fa'
+	)
+	hexgoto.bind("<Button-1>", hexgotobutton)
+	hexgoto.grid(column=2, row=0, sticky="nsew")
+
+	hexlabeltext = StringVar()
+	hexlabel = Label(hexblock, textvariable=hexlabeltext, relief=RIDGE, font=globalfont)
+	hexlabel.grid(column=3, row=0, sticky='nsew', padx=3, pady=3)
+
+	hexplus = Button(
+		hexblock, 
+		text='>', 
+		width=10, 
+		default=ACTIVE, 
+		font=globalfont,
+		highlightbackground='#4d66fa'
+	)
+	hexplus.bind('<Button-1>', hexplusbutton)
+	hexplus.grid(column=4, row=0, sticky='nsew')
+
+	# text view tab
+	texttext = Text(
+		textcolumn, 
+		yscrollcommand=lambda f, l: autoscroll(ttvsb, f, l),
+	    bd=2, 
+	    relief=SUNKEN, 
+	    font=globalfont, 
+	    highlightbackground='lightblue'
+	)
+	texttext.grid(column=0, row=0, sticky="nsew")
+
+	ttvsb = ttk.Scrollbar(textcolumn, orient="vertical")
+	ttvsb.grid(column=1, row=0, sticky='ns')
+	ttvsb['command'] = texttext.yview
+
+	# block for moving between the pages of the text view
+	textblock = Frame(textcolumn, bd=2, relief=RAISED, bg='#4d66fa');
+	textblock.grid(column = 0, row = 1, sticky="nsew", columnspan=2)
+	textblock.grid_columnconfigure(3, weight=1)
+
+	def showTextPage(page):
+		texttext.delete(1.0, END)
+		texttext.insert(END, page)
+		textlabeltext.set(textViewer.status())
+
+	def refreshTextStatus(viewer):
+		# the line count is known once the viewer has indexed the whole file
+		if viewer is not textViewer:
+			return
+		textlabeltext.set(viewer.status())
+		if not viewer.indexed():
+			root.after(500, lambda: refreshTextStatus(viewer))
+
+	def showTextFile(filename):
+		# first page in the main text area, all of them in the "Text view" tab
+		global textViewer
+		try:
+			textViewer = textviewer.TextViewer(filename)
+		except (EnvironmentError, ValueError) as e:
+			maintext(u'Unable to open the file for the text view: %s' % e)
+			texttext.delete(1.0, END)
+			texttext.insert(END, "Unable to open the file for the text view: %s" % e)
+			textlabeltext.set("")
+			notebook.add(textcolumn)
+			log("Unable to open %s for the text view: %s" % (filename, e))
+			return
+		page = textViewer.page()
+		maintext(page)
+		if not textViewer.atEnd():
+			maintext(u'\n\n(first %i lines, see the "Text view" tab for the rest of the file)' % textViewer.pageLines)
+		showTextPage(page)
+		notebook.add(textcolumn)
+		refreshTextStatus(textViewer)
+
+	def textlessbutton(event):
+		if textViewer is not None:
+			showTextPage(textViewer.previousPage())
+
+	def textplusbutton(event):
+		if textViewer is not None:
+			showTextPage(textViewer.nextPage())
+
+	def textgotobutton(event):
+		if textViewer is None:
+			return
+		try:
+			line = int(textline.get())
+		except ValueError:
+			log("Invalid line number \"%s\"." % textline.get())
+			return
+		showTextPage(textViewer.goto(line - 1))
+
+	textless = Button(
+		textblock, 
+		text="<", 
+		width=10, 
+		default=ACTIVE, 
+		font=globalfont,
+		highlightbackground='#4d66fa'
+	)
+	textless.bind("<Button-1>", textlessbutton)
+	textless.grid(column=0, row=0, sticky="nsew")
+
+	textline = Entry(textblock, width=12, font=globalfont)
+	textline.bind("<Return>", textgotobutton)
+	textline.grid(column=1, row=0, sticky="nsew", padx=3, pady=3)
+
+	textgoto = Button(
+		textblock, 
+		text="Go to line", 
+		default=ACTIVE, 
+		font=globalfont,
+		highlightbackground='#4d66fa'
+	)
+	textgoto.bind("<Button-1>", textgotobutton)
+	textgoto.grid(column=2, row=0, sticky="nsew")
+
+	textlabeltext = StringVar()
+	textlabel = Label(textblock, textvariable=textlabeltext, relief=RIDGE, font=globalfont)
+	textlabel.grid(column=3, row=0, sticky='nsew', padx=3, pady=3)
+
+	textplus = Button(
+		textblock, 
+		text='>', 
+		width=10, 
+		default=ACTIVE, 
+		font=globalfont,
+		highlightbackground='#4d66fa'
+	)
+	textplus.bind('<Button-1>', textplusbutton)
+	textplus.grid(column=4, row=0, sticky='nsew')
+
 	# menu --------------------------------------------------------------------------------------------------
 	
 	def aboutBox():
@@ -670,7 +1074,7 @@ if __name__ == '__main__':
 		exit(0)
 			
 	def placesMenu(filename, filepath=None):
-		if not filename:
+		if not filename or not manifestLoaded():
 			return
 
 		file_id = mbdb.fileId(filename, filepath)
@@ -678,7 +1082,7 @@ if __name__ == '__main__':
 			log('File %s not found.' % filename)
 			return
 		
-		nodeFound = searchIndexInTree(file_id)
+		nodeFound = treeItemOfFile(file_id)
 		
 		if nodeFound is None:
 			log(u'Node not found in tree while searching for file %s (id %s).' % (filename, file_id))
@@ -688,6 +1092,29 @@ if __name__ == '__main__':
 		tree.selection_set(nodeFound)
 		OnClick() #triggers refresh of main text area
 	
+	def typesMenu(mime=None):
+		# lists the files of the given type (or the number of files of each type) in the
+		# main text area, from the types stored by the classify pass
+		if not manifestLoaded():
+			return
+		
+		types = mbdb.fileTypes()
+		if not types:
+			log("No file types yet, please run Types > Classify files first.")
+			return
+		
+		clearmaintext()
+		if mime is None:
+			maintext("Files by type:\n\n")
+			for file_type, count in types:
+				maintext("%6i  %s\n" % (count, file_type))
+			return
+		
+		files = mbdb.filesOfType(mime)
+		maintext("Files of type %s: %i\n\n" % (mime, len(files)))
+		for record in files:
+			maintext("%s  %s::%s\n" % (record['fileid'], record['domain'], os.path.join(record['file_path'], record['file_name'])))
+	
 	def base64dec():	
 		try:
 			enctext = textarea.get(SEL_FIRST, SEL_LAST)
@@ -747,9 +1174,31 @@ if __name__ == '__main__':
 	placesmenu.add_separator()
 	placesmenu.add_command(label="Write Txt", command=writeTXT)
 	placesmenu.add_command(label="Decode Base64", command=base64dec)
+	placesmenu.add_command(label="Expand all", command=expandAll)
 		
 	menubar.add_cascade(label="Places", menu=placesmenu)
 	
+	# Types menu
+	typesmenu = Menu(menubar, tearoff=0)
+	
+	typesmenu.add_command(label="Classify files", command=lambda:classifyFiles())
+	typesmenu.add_separator()
+	typesmenu.add_command(
+		label="SQLite databases", 
+		command=lambda:typesMenu('data/sqlite')
+	)
+	typesmenu.add_command(
+		label="JPEG images", 
+		command=lambda:typesMenu('image/jpeg')
+	)
+	typesmenu.add_command(
+		label="Binary plists", 
+		command=lambda:typesMenu('data/binary_plist')
+	)
+	typesmenu.add_command(label="All types", command=lambda:typesMenu())
+	
+	menubar.add_cascade(label="Types", menu=typesmenu)
+	
 	# Windows menu
 	winmenu = Menu(menubar, tearoff=0)
 	
@@ -760,7 +1209,8 @@ if __name__ == '__main__':
 	
 	def getFunc(m_name):
 		def func():
-			getattr(sys.modules[m_name], 'main')(mbdb, backup_path)
+			if manifestLoaded():
+				getattr(sys.modules[m_name], 'main')(mbdb, backup_path)
 		return func
 
 	for module in os.listdir(pluginsdir):
@@ -819,53 +1269,8 @@ if __name__ == '__main__':
 	tree.insert(base_files_index, 'end', text="Info.plist", values=("X", "", 0), tag='base')
 	tree.insert(base_files_index, 'end', text="Status.plist", values=("X", "", 0), tag='base')
 	
-	domain_types = mbdb.domainTypes()
-
 	print("\nBuilding UI..")
 	
-	# building the file hierarchy
-	for domain_type in domain_types:
-		domain_type_index = tree.insert('', 'end', text=domain_type, tag='base')
-		print(u'Listing elements for domain family: %s' % domain_type)
-		
-		domain_names = mbdb.domainTypeMembers(domain_type)
-		
-		for domain_name in domain_names:
-			domain_name_index = domain_type_index
-			if domain_name:
-				domain_name_index = tree.insert(domain_type_index, 'end', text=domain_name, tag='base')
-			
-			paths = mbdb.filePathsOfDomain(domain_type, domain_name)
-			
-			file_path_map = {} # store name, treeindex pairs
-
-			for path in paths:
-				path_index = file_path_map.get(path, domain_name_index)
-				if path_index == domain_name_index:
-					if path:
-						path_index = tree.insert(domain_name_index, 'end', text=path, tag='base')
-				
-				files = mbdb.filesInDir(domain_type, domain_name, path)
-				
-				for f in files:
-					file_name = f['file_name']
-					file_len  = f['filelen']
-					file_id   = f['id']
-					file_type = f['type']
-
-					if (file_len) < 1024:
-						file_dim = unicode(file_len) + u' B'
-					else:
-						file_dim = unicode(file_len / 1024) + u' KiB'
-
-					if file_name:
-						file_index = tree.insert(path_index, 'end', text=file_name, values=(file_type, file_dim, file_id), tag='base')
-						if file_type == u'd':
-							file_path_map[os.path.join(path, file_name)] = file_index
-					else:
-						tree.item(path_index, values=(file_type, file_dim, file_id))
-
-			
 	print(u'Construction complete.\n')
 	
 	# Now that the UI has been built, we cancel the "withdraw" operation done before
@@ -983,6 +1388,9 @@ if __name__ == '__main__':
 	
 		global fileNameForViewer
 		global old_label_image
+		global hexFile
+		global hexViewer
+		global textViewer
 	
 		if not tree.selection():
 			return;
@@ -994,8 +1402,19 @@ if __name__ == '__main__':
 		# clear notebook additional panes
 		notebook.hide(previewcolumn)
 		notebook.hide(exifcolumn)
+		notebook.hide(hexcolumn)
+		notebook.hide(textcolumn)
+		hexFile = None
+		if hexViewer is not None:
+			hexViewer.close()
+			hexViewer = None
+		if textViewer is not None:
+			textViewer.close()
+			textViewer = None
 		
 		item = tree.selection()[0]
+		# the values of a domain (or path) come with its content
+		populateNode(item)
 		item_text = tree.item(item, "text")
 		item_type = tree.set(item, "type")
 		item_id = tree.set(item, "id")
@@ -1020,12 +1439,8 @@ if __name__ == '__main__':
 				
 				#print file content (if text file) otherwise only first 50 chars
 				if (filemagic == "ASCII text" or filemagic.partition("/")[0] == "text"):
-					with open(item_realpath, 'rb') as fh:
-						maintext("\n\nASCII content:\n\n")
-						line = fh.readline()
-						while line:
-							line = fh.readline()
-							maintext(line)
+					maintext("\n\nASCII content:\n\n")
+					showTextFile(item_realpath)
 				else:
 					with open(item_realpath, 'rb') as fh:
 						text = fh.read(30)
@@ -1035,7 +1450,7 @@ if __name__ == '__main__':
 				#if binary plist:
 				if (filemagic.partition("/")[2] == "binary_plist"):					
 					maintext("\n\nDecoding binary Plist file:\n\n")
-					maintext(plistutils.readPlist(item_realpath))
+					maintext(plistutils.plistCache.readPlist(item_realpath))
 			
 			else:
 				log(u'...troubles while opening file %s (does not exist)' % item_realpath)
@@ -1104,28 +1519,41 @@ if __name__ == '__main__':
 			maintext(u'unable to analyze file')
 			return			
 		
+		# file type (from magic numbers), first 30 bytes and MD5/SHA-1 hashes; the hashes are
+		# stored in the manifest database, and only computed (along with the rest, from a
+		# single read of the file) if they are not, or if the file was modified since
+		probed = []
+		def probeFile(path):
+			probed.append(magic.probe(path, 30, hashutils.hashNames))
+			return probed[0][2]
+		try:
+			hashes = mbdb.fileHashes(item_fileid, probeFile)
+			if probed:
+				filemagic, first30bytes = probed[0][:2]
+			else:
+				filemagic, first30bytes = magic.probe(item_realpath, 30, ())[:2]
+		except EnvironmentError as e:
+			log(u'Unable to read file %s: %s' % (item_realpath, e))
+			hashes = {'md5': u'<none>', 'sha1': u'<none>'}
+			filemagic, first30bytes = u'<none>', ''
+		
 		# print file type (from magic numbers)
-		filemagic = magic.file(item_realpath)
 		maintext(u'\nFile type (from magic numbers): %s' % filemagic)
 		
-		# print file MD5 hash
+		# print file MD5 and SHA-1 hashes
 		maintext(u'\nFile MD5 hash: ')
-		maintext(md5(item_realpath))
+		maintext(hashes['md5'])
+		maintext(u'\nFile SHA-1 hash: ')
+		maintext(hashes['sha1'])
 		
 		#print first 30 bytes from file
-		with open(item_realpath, u'rb') as fh:
-			first30bytes = fh.read(30)
-			maintext(u'\n\nFirst 30 hex bytes from file: ')
-			maintext(u'\n' + hex2nums(first30bytes))
+		maintext(u'\n\nFirst 30 hex bytes from file: ')
+		maintext(u'\n' + hex2nums(first30bytes))
 			
 		#print file content (if ASCII file) otherwise only first 30 bytes
 		if (filemagic == u'ASCII text' or filemagic.partition('/')[0] == u'text'):
-			with open(item_realpath, 'rb') as fh:
-				maintext(u'\n\nASCII content:\n\n')
-				line = fh.readline()
-				while line:
-					line = fh.readline()
-					maintext(line)
+			maintext(u'\n\nASCII content:\n\n')
+			showTextFile(item_realpath)
 		else:
 			maintext("\n\nFirst 30 chars from file (string): ")
 			maintext("\n" + hex2string(first30bytes))					
@@ -1203,7 +1631,7 @@ if __name__ == '__main__':
 		#if binary plist:
 		if (filemagic.partition("/")[2] == "binary_plist"):			
 			maintext("\n\nDecoding binary Plist file:\n\n")
-			maintext(plistutils.readPlist(item_realpath))
+			maintext(plistutils.plistCache.readPlist(item_realpath))
 		
 		#if sqlite, print tables list
 		if (filemagic.partition("/")[2] == "sqlite"):	
@@ -1238,21 +1666,131 @@ if __name__ == '__main__':
 				maintext("\nUnexpected error: %s"%sys.exc_info()[1])
 				tempdb.close()
 			
-		# if unknown "data", dump hex
+		# hex view of the file (memory mapped, one page at a time), opened when its tab
+		# is shown
+		hexFile = item_realpath
+		hextext.delete(1.0, END)
+		hexlabeltext.set("")
+		notebook.add(hexcolumn)
+		
+		# if unknown "data", dump hex (first page, the others are in the hex view)
 		if (filemagic == "data"):
-			limit = 10000
-			maintext("\n\nDumping hex data (limit %i bytes):\n"%limit)
-			content = ""
-			with open(item_realpath, 'rb') as fh:
-				line = fh.readline()
-				while line:
-					line = fh.readline()
-					content += line;
+			if showHexView():
+				maintext("\n\nHex data (%s):\n\n" % hexViewer.status())
+				maintext(hexViewer.page())
+				maintext("\n\nSee the \"Hex view\" tab for the rest of the file.")
+			else:
+				maintext("\n\nUnable to read the file for a hex dump.")
+
+	# Manifest loading -----------------------------------------------------------------------------------------
+	
+	# the manifest database is filled by a worker thread, while the window is already
+	# shown; the worker posts its progress and the domains, as soon as each one is
+	# stored, to this queue
+	loaderQueue = Queue.Queue()
+	
+	def loadManifest():
+		try:
+			mbdb.load(progress=lambda count: loaderQueue.put(('progress', count)),
+				domainsLoaded=lambda domains: loaderQueue.put(('domains', domains)))
+			loaderQueue.put(('loaded', None))
+			loaderQueue.put(('done', None))
+		except Exception as e:
+			loaderQueue.put(('error', e))
+	
+	def pollLoader():
+		global loadedDomains
+		# handles what the worker has posted, a limited number of messages at a time so
+		# that the UI stays responsive
+		for i in range(50):
+			try:
+				message, content = loaderQueue.get_nowait()
+			except Queue.Empty:
+				break
 			
-			maintext(dump(content, 16, limit))
+			if message == 'progress':
+				root.title('iPhone Backup analyzer - loading manifest: %i records' % content)
+			elif message == 'loaded':
+				log("Read elements: %i%s" % (len(mbdb), " (from cache)" if mbdb.cached else ""))
+				if mbdb.changes is not None:
+					log("Changes since the cached version of the backup: %s" % mbdb.changes)
+			elif message == 'domains':
+				# their items are inserted one level at a time, when a node is expanded
+				for domain_type, domain_name in content:
+					addDomain(domain_type, domain_name)
+			elif message == 'done':
+				loadedDomains = None
+				root.title('iPhone Backup analyzer')
+				log("Manifest loaded.")
+				return
+			elif message == 'error':
+				root.title('iPhone Backup analyzer')
+				log("Error while loading the manifest: %s" % content)
+				tkMessageBox.showerror("Manifest", "Error while loading the manifest:\n%s" % content)
+				return
+		root.after(100, pollLoader)
+	
+	def manifestLoaded():
+		# once the worker is done, and all the domains it posted are listed
+		loaded = mbdb.loaded and loadedDomains is None
+		if not loaded:
+			log("The manifest is still loading, please wait.")
+		return loaded
+	
+	# the classify pass (magic numbers of every file, see ManifestMBDB.classify) runs in
+	# its own worker thread, which uses a pool of processes and posts its progress here
+	classifierQueue = Queue.Queue()
+	classifier = []
+	
+	def classify():
+		try:
+			count = mbdb.classify(progress=lambda done, total: classifierQueue.put(('progress', (done, total))))
+			classifierQueue.put(('done', count))
+		except Exception as e:
+			classifierQueue.put(('error', e))
+	
+	def pollClassifier():
+		while True:
+			try:
+				message, content = classifierQueue.get_nowait()
+			except Queue.Empty:
+				break
+			
+			if message == 'progress':
+				root.title('iPhone Backup analyzer - classifying files: %i of %i' % content)
+			elif message == 'done':
+				del classifier[:]
+				root.title('iPhone Backup analyzer')
+				log("Files classified: %i" % content)
+				return
+			elif message == 'error':
+				del classifier[:]
+				root.title('iPhone Backup analyzer')
+				log("Error while classifying files: %s" % content)
+				return
+		root.after(250, pollClassifier)
+	
+	def classifyFiles():
+		if not manifestLoaded():
+			return
+		if classifier:
+			log("Files are already being classified, please wait.")
+			return
+		
+		log("Classifying files...")
+		classifier.append(threading.Thread(target=classify))
+		classifier[0].daemon = True
+		classifier[0].start()
+		root.after(250, pollClassifier)
+	
+	loader = threading.Thread(target=loadManifest)
+	loader.daemon = True
+	loader.start()
+	root.after(100, pollLoader)
 
 	# Main ---------------------------------------------------------------------------------------------------
 
+	tree.bind("<<TreeviewOpen>>", lambda event: populateNode(tree.focus()))
 	tree.bind("<ButtonRelease-1>", OnClick)
 	tree.bind("<KeyRelease-Up>", OnClick)
 	tree.bind("<KeyRelease-Down>", OnClick)
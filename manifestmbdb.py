@@ -1,8 +1,26 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
+import os
+import re
+import sys
 import struct
+import marshal
 import sqlite3
 import hashlib
+import binascii
+import mmap
+import operator
+import itertools
+import collections
+import multiprocessing
+import threading
+import functools
+import contextlib
+import time
+import tempfile
+import shutil
+import magic
+import hashutils
 	
 class ManifestDatabaseError(Exception):
 	pass
@@ -10,17 +28,40 @@ class ManifestDatabaseError(Exception):
 class ManifestDatabase(sqlite3.Connection):
 
 	@staticmethod
-	def connect(db_file=':memory:'):
-		conn = sqlite3.connect(db_file, factory=ManifestDatabase)
+	def connect(db_file=':memory:', check_same_thread=True):
+		conn = sqlite3.connect(db_file, factory=ManifestDatabase, check_same_thread=check_same_thread)
 		conn.row_factory = sqlite3.Row
 		return conn
 
+	# bump this whenever the tables change: cached databases of another version are rebuilt
+	schemaVersion = 3
+
+	# the tables of the database: a file holding any other table is not ours to rebuild
+	tables = (u'indice', u'properties', u'hashes', u'metadata')
+
 	def __init__(self, *args, **kwargs):
 		super(ManifestDatabase, self).__init__(*args, **kwargs)
+		try:
+			foreign = [name for name in self._tableNames() if name not in ManifestDatabase.tables]
+		except sqlite3.DatabaseError as e:
+			self.close()
+			raise ManifestDatabaseError(u'unable to open the manifest database: %s' % e)
+		if foreign:
+			self.close()
+			raise ManifestDatabaseError(u'not a manifest database, it holds other tables: %s' % u', '.join(foreign))
+		self._createTables()
+
+	def _tableNames(self):
+		cursor = self.cursor()
+		cursor.execute(u"SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+		names = [row[0] for row in cursor.fetchall()]
+		cursor.close()
+		return names
 
+	def _createTables(self):
 		cursor = self.cursor()
 		cursor.execute(u'''
-			CREATE TABLE indice (
+			CREATE TABLE IF NOT EXISTS indice (
 				id INTEGER PRIMARY KEY AUTOINCREMENT,
 				type VARCHAR(1),
 				permissions VARCHAR(9),
@@ -37,18 +78,89 @@ class ManifestDatabase(sqlite3.Connection):
 				file_name VARCHAR(100),
 				link_target VARCHAR(100),
 				datahash VARCHAR(100),
-				flag VARCHAR(100)
+				flag VARCHAR(100),
+				mime VARCHAR(100),
+				mime_datahash VARCHAR(100)
 			)
 		''')
 		
 		cursor.execute(u'''
-			CREATE TABLE properties (
+			CREATE TABLE IF NOT EXISTS properties (
 				id INTEGER PRIMARY KEY AUTOINCREMENT,
 				fileid INTEGER,
 				name VARCHAR(100),
 				value VARCHAR(100)
 			)
 		''')
+
+		# hashes of the files of the backup, valid as long as the file size and modification
+		# time are the same (see ManifestMBDB.fileHashes)
+		cursor.execute(u'''
+			CREATE TABLE IF NOT EXISTS hashes (
+				fileid VARCHAR(50) PRIMARY KEY,
+				filelen INT,
+				mtime REAL,
+				md5 VARCHAR(32),
+				sha1 VARCHAR(40)
+			)
+		''')
+
+		# describes the Manifest.mbdb the tables were built from (see ManifestMBDB)
+		cursor.execute(u'''
+			CREATE TABLE IF NOT EXISTS metadata (
+				key VARCHAR(100) PRIMARY KEY,
+				value VARCHAR(100)
+			)
+		''')
+		cursor.close()
+		self.commit()
+
+	def reset(self):
+		"""Drop the tables (and their indexes), and create them again empty"""
+		cursor = self.cursor()
+		for name in ManifestDatabase.tables:
+			cursor.execute(u'DROP TABLE IF EXISTS "%s"' % name)
+		cursor.close()
+		self.commit()
+		self._createTables()
+
+	def metadata(self):
+		"""Return the content of the metadata table as a dict"""
+		cursor = self.cursor()
+		cursor.execute(u'SELECT key, value FROM metadata')
+		metadata = dict((row[0], row[1]) for row in cursor)
+		cursor.close()
+		return metadata
+
+	def setMetadata(self, metadata):
+		cursor = self.cursor()
+		cursor.executemany(u'INSERT OR REPLACE INTO metadata(key, value) VALUES (?, ?)', metadata.items())
+		cursor.close()
+		self.commit()
+
+	_cachedHashesQuery = u'''
+		SELECT md5, sha1
+		FROM hashes
+		WHERE fileid = ? AND filelen = ? AND mtime = ?
+	'''
+
+	def cachedHashes(self, fileid, filelen, mtime):
+		"""Return the hashes stored for the file (as a dict by hash name), or None if there
+		are none for this size and modification time"""
+		cursor = self.cursor()
+		cursor.execute(self._cachedHashesQuery, (fileid, filelen, mtime))
+		row = cursor.fetchone()
+		cursor.close()
+		if row is None:
+			return None
+		return {'md5': row['md5'], 'sha1': row['sha1']}
+
+	def cacheHashes(self, fileid, filelen, mtime, hashes):
+		cursor = self.cursor()
+		cursor.execute(u'INSERT OR REPLACE INTO hashes(fileid, filelen, mtime, md5, sha1) VALUES (?, ?, ?, ?, ?)',
+			(fileid, filelen, mtime, hashes['md5'], hashes['sha1']))
+		cursor.close()
+		self.commit()
 		
 	
 	_insertStatement = u'''
@@ -71,121 +183,1066 @@ class ManifestDatabase(sqlite3.Connection):
 			flag
 		) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
 
-	def insertRecord(self, rec, commit=True):
-		# decoding element type (symlink, file, directory)
-		if (rec[u'mode']   & 0xE000) == 0xA000: obj_type = u'l' # symlink
-		elif (rec[u'mode'] & 0xE000) == 0x8000: obj_type = u'-' # file
-		elif (rec[u'mode'] & 0xE000) == 0x4000: obj_type = u'd' # dir
+	# same as above, but with ids assigned by the caller (used for bulk loading)
+	_bulkInsertStatement = u'''
+		INSERT INTO indice(
+			id,
+			type, 
+			permissions, 
+			userid, 
+			groupid, 
+			filelen, 
+			mtime, 
+			atime, 
+			ctime, 
+			fileid, 
+			domain_type, 
+			domain, 
+			file_path, 
+			file_name, 
+			link_target, 
+			datahash, 
+			flag
+		) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
 
-		# separates domain type (AppDomain, HomeDomain, ...) from domain name
-		[domaintype, sep, domain] = rec[u'domain'].partition(u'-');
+	_insertPropertyStatement = u'INSERT INTO properties(fileid, name, value) VALUES (?, ?, ?)'
 
-		# separates file name from file path
-		[filepath, sep, filename] = rec['path'].rpartition(u'/')
+	# the same, for the rows of a block (see _blockRows): their ids are numbered from 1
+	# within the block, and offset by the number of rows stored before it
+	_blockInsertStatement = _bulkInsertStatement.replace(u'VALUES(?,', u'VALUES(? + %d,')
+	_blockPropertyStatement = _insertPropertyStatement.replace(u'VALUES (?,', u'VALUES (? + %d,')
 
-		# TODO: why does this work??? Old code had typo here and made things work
-		'''
-		if (obj_type == u'd'):
-			filepath = rec['path']
-			filename = u'';
-		'''
+	# the same, for a block stored by a worker process in a database of its own, attached
+	# as block
+	_copyBlockStatement = u'''
+		INSERT INTO indice(
+			id,
+			type, 
+			permissions, 
+			userid, 
+			groupid, 
+			filelen, 
+			mtime, 
+			atime, 
+			ctime, 
+			fileid, 
+			domain_type, 
+			domain, 
+			file_path, 
+			file_name, 
+			link_target, 
+			datahash, 
+			flag
+		) SELECT id + %d, type, permissions, userid, groupid, filelen, mtime, atime, ctime,
+			fileid, domain_type, domain, file_path, file_name, link_target, datahash, flag
+		FROM block.indice ORDER BY id'''
 
-		values = (obj_type, self._modestr(rec['mode']), '%08x' % (rec['userid']), '%08x' % (rec['groupid']), rec['filelength'], 
-			rec['mtime'], rec['atime'], rec['ctime'], rec['fileid'], domaintype, domain, filepath, filename,
-			rec['linktarget'], rec['datahash'], rec['flag'],
-		)
+	_copyBlockPropertiesStatement = u'''
+		INSERT INTO properties(fileid, name, value)
+		SELECT fileid + %d, name, value FROM block.properties ORDER BY id'''
 
+	def insertRecord(self, rec, commit=True):
 		cursor = self.cursor()
-		cursor.execute(ManifestDatabase._insertStatement, values)
+		cursor.execute(ManifestDatabase._insertStatement, _recordValues(rec))
 		
 		# check if file has properties to store in the properties table
 		if (rec['properties']):
-			query = u'''
-				SELECT id FROM indice WHERE
-				domain = ?
-				AND fileid = ?
-				LIMIT 1
-			'''
-			 
-			cursor.execute(query, (domain, rec['fileid']))
-			rowid = cursor.fetchone()
-			
-			if (rowid):
-				index = rowid[0]
-				properties = rec['properties']
-				query = u'INSERT INTO properties(fileid, name, value) VALUES (?, ?, ?)'
-				values = [(index, p, properties[p]) for p in properties]
-				cursor.executemany(query, values);
+			index = cursor.lastrowid
+			properties = rec['properties']
+			values = [(index, p, properties[p]) for p in properties]
+			cursor.executemany(ManifestDatabase._insertPropertyStatement, values);
 
 		cursor.close()
 		if commit:
 			self.commit()
 
-	def _modestr(self, val):
-		"""Return the string representation of a mode octal"""
-		def mode(val):
-			r = u'r' if (val & 0x4) else u'-'
-			w = u'w' if (val & 0x2) else u'-'
-			x = u'x' if (val & 0x1) else u'-'
-			return r+w+x
+	def insertBlocks(self, blocks, lock=None, domainsStored=None):
+		"""Bulk insert blocks of records (_Blocks, see _blockRows), then build the indexes.
 
-		val = val & 0x0FFF
-		return mode(val>>6) + mode((val>>3)) + mode(val)
-		
+		Ids are assigned here rather than read back from the database, and journaling and
+		syncing are turned off while loading (a half loaded database is useless anyway).
+
+		Each block is committed on its own, written holding lock (if given), so that other
+		threads can query the database between two blocks. After each commit, domainsStored
+		(if given) is called with the list of the (domain type, domain) whose records are
+		all stored: the ones the manifest has moved past. A domain whose records turn out
+		not to be contiguous in the manifest is reported again, once, at the end.
+		"""
+		if lock is None:
+			lock = threading.Lock()
+		with lock:
+			cursor = self.cursor()
+			self.commit()
+			journalMode = cursor.execute(u'PRAGMA journal_mode').fetchone()[0]
+			synchronous = cursor.execute(u'PRAGMA synchronous').fetchone()[0]
+			cursor.execute(u'PRAGMA journal_mode = OFF')
+			cursor.execute(u'PRAGMA synchronous = OFF')
+			index = cursor.execute(u'SELECT MAX(id) FROM indice').fetchone()[0] or 0
+
+		def store(index, block, finished):
+			with lock:
+				if block.database is None:
+					cursor.executemany(ManifestDatabase._blockInsertStatement % index, block.rows)
+					cursor.executemany(ManifestDatabase._blockPropertyStatement % index, block.propertyRows)
+					self.commit()
+				else:
+					# copied within SQLite, the rows are never turned into python objects here
+					self.commit()
+					cursor.execute(u'ATTACH DATABASE ? AS block', (block.database,))
+					try:
+						cursor.execute(ManifestDatabase._copyBlockStatement % index)
+						cursor.execute(ManifestDatabase._copyBlockPropertiesStatement % index)
+						self.commit()
+					finally:
+						cursor.execute(u'DETACH DATABASE block')
+			if domainsStored is not None and finished:
+				domainsStored(finished)
+
+		try:
+			reported = set()
+			reportedAgain = set()
+			domain = None
+			for block in blocks:
+				finished = []
+				for key in block.domains:
+					if key != domain:
+						if domain in reported:
+							reportedAgain.add(domain)
+						elif domain is not None:
+							finished.append(domain)
+							reported.add(domain)
+						domain = key
+				store(index, block, finished)
+				index += block.count
+			finished = []
+			if domain in reported:
+				reportedAgain.add(domain)
+			elif domain is not None:
+				finished.append(domain)
+			if domainsStored is not None and (finished or reportedAgain):
+				domainsStored(finished + sorted(reportedAgain))
+
+			with lock:
+				self.createIndexes()
+		finally:
+			with lock:
+				self.commit()
+				cursor.execute(u'PRAGMA journal_mode = %s' % journalMode)
+				cursor.execute(u'PRAGMA synchronous = %d' % synchronous)
+				cursor.close()
+
+	_updateStatement = u'''
+		UPDATE indice SET
+			type = ?, 
+			permissions = ?, 
+			userid = ?, 
+			groupid = ?, 
+			filelen = ?, 
+			mtime = ?, 
+			atime = ?, 
+			ctime = ?, 
+			fileid = ?, 
+			domain_type = ?, 
+			domain = ?, 
+			file_path = ?, 
+			file_name = ?, 
+			link_target = ?, 
+			datahash = ?, 
+			flag = ?,
+			mime = NULL,
+			mime_datahash = NULL
+		WHERE id = ?'''
+
+	def updateRecords(self, records):
+		"""Bring the database in line with a new version of the manifest, given all its records.
+
+		Records are matched to the existing rows by file id. Only the rows of new files are
+		inserted, the ones of files not in the manifest any more deleted, and the ones whose
+		data hash (or any other field, or property) changed updated. Returns a ManifestChanges.
+		"""
+		cursor = self.cursor()
+
+		# file id => list of (row id, values, properties) of the rows currently in the database
+		properties = {}
+		cursor.execute(u'SELECT fileid, name, value FROM properties')
+		for index, name, value in cursor.fetchall():
+			properties.setdefault(index, {})[name] = value
+		existing = {}
+		cursor.execute(u'''
+			SELECT id, type, permissions, userid, groupid, filelen, mtime, atime, ctime, fileid,
+				domain_type, domain, file_path, file_name, link_target, datahash, flag
+			FROM indice
+		''')
+		for row in cursor.fetchall():
+			values = tuple(row)[1:]
+			existing.setdefault(row['fileid'], []).append(
+				(row['id'], _normalized(values), properties.get(row['id'], {})))
+
+		changes = ManifestChanges()
+		index = cursor.execute(u'SELECT MAX(id) FROM indice').fetchone()[0] or 0
+		for rec in records:
+			values = _recordValues(rec)
+			recProperties = dict((unicode(k), unicode(v)) for k, v in rec['properties'].items())
+			candidates = existing.get(rec['fileid'])
+
+			if not candidates:
+				index += 1
+				cursor.execute(ManifestDatabase._bulkInsertStatement, (index,) + values)
+				self._insertProperties(cursor, index, recProperties)
+				changes.added.append(rec)
+				continue
+
+			# more than a row can share a file id: an unchanged one is the best match
+			normalized = _normalized(values)
+			for i, (rowid, rowValues, rowProperties) in enumerate(candidates):
+				if rowValues == normalized and rowProperties == recProperties:
+					del candidates[i]
+					break
+			else:
+				rowid = candidates.pop(0)[0]
+				cursor.execute(ManifestDatabase._updateStatement, values + (rowid,))
+				cursor.execute(u'DELETE FROM properties WHERE fileid = ?', (rowid,))
+				self._insertProperties(cursor, rowid, recProperties)
+				changes.updated.append(rec)
+
+		# whatever was not matched is not in the manifest any more
+		for candidates in existing.values():
+			for rowid, rowValues, rowProperties in candidates:
+				cursor.execute(u'DELETE FROM indice WHERE id = ?', (rowid,))
+				cursor.execute(u'DELETE FROM properties WHERE fileid = ?', (rowid,))
+				changes.removed.append(rowValues)
+
+		cursor.close()
+		self.commit()
+		return changes
+
+	def _insertProperties(self, cursor, index, properties):
+		values = [(index, p, properties[p]) for p in properties]
+		cursor.executemany(ManifestDatabase._insertPropertyStatement, values)
+
+	def createIndexes(self):
+		"""Create the indexes used by the queries (after loading, when it is cheaper)"""
+		cursor = self.cursor()
+		# tree building queries (domain types, domains of a type, paths of a domain) are
+		# covered by this index, and files in a directory come out of it already sorted
+		cursor.execute(u'''
+			CREATE INDEX IF NOT EXISTS indice_tree
+			ON indice(domain_type, domain, file_path, file_name)
+		''')
+		# lookups of a file by name (Places menu and plugins)
+		cursor.execute(u'CREATE INDEX IF NOT EXISTS indice_file_name ON indice(file_name, file_path)')
+		cursor.execute(u'CREATE INDEX IF NOT EXISTS properties_fileid ON properties(fileid)')
+		# files of a given type (see ManifestMBDB.classify)
+		cursor.execute(u'CREATE INDEX IF NOT EXISTS indice_mime ON indice(mime)')
+		cursor.close()
+		self.commit()
 
 class ManifestMBDBError(Exception):
 	pass
 
+# element type (symlink, file, directory) of the file type bits of a mode
+_objectTypes = {0xA000: u'l', 0x8000: u'-', 0x4000: u'd'}
+
+def _modestr(val):
+	"""Return the string representation of a mode octal"""
+	def mode(val):
+		r = u'r' if (val & 0x4) else u'-'
+		w = u'w' if (val & 0x2) else u'-'
+		x = u'x' if (val & 0x1) else u'-'
+		return r+w+x
+
+	val = val & 0x0FFF
+	return mode(val>>6) + mode((val>>3)) + mode(val)
+
+# string of each permissions value, looked up rather than computed for every record
+_modeStrings = [_modestr(val) for val in xrange(0x1000)]
+
+def _recordValues(rec):
+	"""Return the values of the indice columns for the given record (a ManifestRecord,
+	or a plain tuple of the same fields)"""
+	mode = rec[5]
+
+	# separates domain type (AppDomain, HomeDomain, ...) from domain name
+	[domaintype, sep, domain] = rec[0].partition(u'-');
+
+	# separates file name from file path
+	[filepath, sep, filename] = rec[1].rpartition(u'/')
+
+	# fields: domain, path, linktarget, datahash, unknown1, mode, unknown2, unknown3,
+	# userid, groupid, mtime, atime, ctime, filelength, flag, properties, fileid
+	return (_objectTypes.get(mode & 0xE000, u'?'), _modeStrings[mode & 0x0FFF], '%08x' % rec[8],
+		'%08x' % rec[9], rec[13], rec[10], rec[11], rec[12], rec[16], domaintype, domain, filepath,
+		filename, rec[2], rec[3], rec[14])
+
+# the rows of a block of records (see _blockRows), or the database a worker process stored
+# them in (see _writeBlock)
+_Block = collections.namedtuple('_Block', 'count rows propertyRows domains database')
+
+def _blockRows(records):
+	"""Return the rows of a block of records, as a _Block: the ids of the rows are
+	numbered from 1 within the block (see ManifestDatabase.insertBlocks), and domains
+	lists the (domain type, domain) of the records, once for each run of records of the
+	same domain"""
+	rows = []
+	propertyRows = []
+	domains = []
+	domain = None
+	index = 0
+	for index, record in enumerate(records, 1):
+		values = _recordValues(record)
+		rows.append((index,) + values)
+		properties = record[15]
+		if properties:
+			propertyRows.extend((index, name, properties[name]) for name in properties)
+		if values[9:11] != domain:
+			domain = values[9:11]
+			domains.append(domain)
+	return _Block(index, rows, propertyRows, domains, None)
+
+def _writeBlock(database, block):
+	"""Store the rows of the block in a new database file (in a worker process)"""
+	db = ManifestDatabase.connect(database)
+	try:
+		db.execute(u'PRAGMA journal_mode = OFF')
+		db.execute(u'PRAGMA synchronous = OFF')
+		db.executemany(ManifestDatabase._blockInsertStatement % 0, block.rows)
+		db.executemany(ManifestDatabase._blockPropertyStatement % 0, block.propertyRows)
+		db.commit()
+	finally:
+		db.close()
+
+def _normalized(values):
+	"""Return the given indice values as they read back from the database (all text)"""
+	return tuple(v if isinstance(v, unicode) else unicode(v) for v in values)
+
+class ManifestChanges(object):
+	"""What changed in the database when it was updated to a new version of the manifest:
+	the records added and updated, and the (indice) values of the rows removed"""
+
+	def __init__(self):
+		self.added = []
+		self.updated = []
+		self.removed = []
+
+	def __len__(self):
+		return len(self.added) + len(self.updated) + len(self.removed)
+
+	def __str__(self):
+		return '%i added, %i updated, %i removed' % (len(self.added), len(self.updated), len(self.removed))
+
+class _ReadOnlyDict(dict):
+	"""A dict that can not be modified after creation, used for record properties"""
+
+	def _readOnly(self, *args, **kwargs):
+		raise TypeError(u'record properties are read-only')
+
+	__setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readOnly
+
+	def __reduce__(self):
+		return (_readOnlyProperties, (dict(self),))
+
+# most records have no properties, they all share this mapping
+_emptyProperties = _ReadOnlyDict()
+
+def _readOnlyProperties(properties):
+	if not properties:
+		return _emptyProperties
+	return _ReadOnlyDict(properties)
+
+class ManifestRecord(tuple):
+	"""A single decoded record of the Manifest.mbdb file.
+
+	Records are compact immutable tuples, but their fields can be read by name either
+	as attributes (rec.domain) or with dict style access (rec['domain']). They behave
+	as read only mappings: iterating yields the field names and 'domain' in rec is
+	true; rec[0] still gives the first value.
+	"""
+	__slots__ = ()
+
+	_fields = ('domain', 'path', 'linktarget', 'datahash', 'unknown1', 'mode', 'unknown2', 'unknown3',
+		'userid', 'groupid', 'mtime', 'atime', 'ctime', 'filelength', 'flag', 'properties', 'fileid')
+	_fieldIndex = dict((name, i) for i, name in enumerate(_fields))
+
+	def __getitem__(self, key):
+		if isinstance(key, basestring):
+			try:
+				key = self._fieldIndex[key]
+			except KeyError:
+				raise KeyError(key)
+		return tuple.__getitem__(self, key)
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def __iter__(self):
+		return iter(self._fields)
+
+	def __contains__(self, key):
+		return key in self._fieldIndex
+
+	def iterkeys(self):
+		return iter(self._fields)
+
+	def itervalues(self):
+		return tuple.__iter__(self)
+
+	def iteritems(self):
+		return itertools.izip(self._fields, tuple.__iter__(self))
+
+	def keys(self):
+		return list(self._fields)
+
+	def values(self):
+		return list(tuple.__iter__(self))
+
+	def items(self):
+		return zip(self._fields, tuple.__iter__(self))
+
+	def __reduce__(self):
+		# tuple(self) would give the field names
+		return (ManifestRecord, (tuple(tuple.__iter__(self)),))
+
+	def __repr__(self):
+		return 'ManifestRecord(%s)' % ', '.join('%s=%r' % item for item in self.items())
+
+for _i, _name in enumerate(ManifestRecord._fields):
+	setattr(ManifestRecord, _name, property(operator.itemgetter(_i)))
+del _i, _name
+
+# Record decoding ----------------------------------------------------------------------------------
+# (module level functions, so that they can also run in the worker processes of a parallel parse)
+
+# fixed width block of a record, from mode to the number of properties
+_fixedFields = struct.Struct('>HIIIIIIIQBB')
+_uint16 = struct.Struct('>H')
+
+def _text(string):
+	"""Decode a raw string, falling back to its hex representation"""
+	if not string:
+		return u''
+	try:
+		return unicode(string, 'utf-8')
+	except UnicodeDecodeError:
+		return string.encode('hex')
+
+class _StringLengths(dict):
+	"""Maps the 2 bytes length prefix of a string to its length (0 for 0xFFFF, the empty
+	string), filled as lengths are met: a lookup is cheaper than unpacking"""
+	def __missing__(self, prefix):
+		length = _uint16.unpack(prefix)[0]
+		if length == 0xFFFF:
+			length = 0
+		self[prefix] = length
+		return length
+
+_stringLengths = _StringLengths()
+
+# what follows the path in most records: no link target, a SHA-1 data hash and no unknown1
+# (files), or none of the three (directories)
+_hashOnly = '\xff\xff\x00\x14'
+_noString = '\xff\xff'
+_noStrings = _noString * 3
+
+def _decodeRecords(data, offset, end, domains, recordType=None, stop=None):
+	"""Decode and yield the records of the .mbdb file starting between offset and end
+
+	domains maps the raw domain names to their decoded version, and is shared between
+	calls so that all the records of a domain use the same string. Records are
+	ManifestRecords, or recordType (tuple for the worker processes). The offset following
+	the last record is appended to stop (a list), if given, once they are all decoded.
+
+	This runs once per record of the manifest: the loop is written out in full, with the
+	strings sliced directly and no function call per field.
+	"""
+	if recordType is None:
+		recordType = ManifestRecord
+	lengths = _stringLengths
+	unpackFixed = _fixedFields.unpack_from
+	fixedSize = _fixedFields.size
+	hashOnly, noString, noStrings = _hashOnly, _noString, _noStrings
+	hexlify = binascii.hexlify
+	sha1 = hashlib.sha1
+	text = _text
+	emptyProperties = _emptyProperties
+	# raw domain => what the file ids of its records are the hash of, followed by the path
+	prefixes = {}
+
+	while offset < end:
+		start = offset + 2
+		offset = start + lengths[data[offset:start]]
+		rawDomain = data[start:offset]
+		start = offset + 2
+		offset = start + lengths[data[offset:start]]
+		rawPath = data[start:offset]
+
+		if data[offset:offset + 4] == hashOnly and data[offset + 24:offset + 26] == noString:
+			linktarget = unknown1 = u''
+			datahash = hexlify(data[offset + 4:offset + 24])
+			offset += 26
+		elif data[offset:offset + 6] == noStrings:
+			linktarget = datahash = unknown1 = u''
+			offset += 6
+		else:
+			start = offset + 2
+			offset = start + lengths[data[offset:start]]
+			linktarget = text(data[start:offset])
+			start = offset + 2
+			offset = start + lengths[data[offset:start]]
+			datahash = hexlify(data[start:offset]) if offset > start else u''
+			start = offset + 2
+			offset = start + lengths[data[offset:start]]
+			unknown1 = text(data[start:offset])
+
+		(mode, unknown2, unknown3, userid, groupid, mtime, atime, ctime, filelength, flag,
+			numProperties) = unpackFixed(data, offset)
+		offset += fixedSize
+
+		if numProperties:
+			properties = {}
+			for x in xrange(numProperties):
+				start = offset + 2
+				offset = start + lengths[data[offset:start]]
+				prop = data[start:offset]
+				start = offset + 2
+				offset = start + lengths[data[offset:start]]
+				properties[text(prop)] = text(data[start:offset])
+			properties = _ReadOnlyDict(properties)
+		else:
+			properties = emptyProperties
+
+		# the raw bytes are what gets hashed, unless they were not valid utf-8 (first
+		# record of a domain, or a string that is not utf-8: the other way round)
+		try:
+			domain = domains[rawDomain]
+			path = unicode(rawPath, 'utf-8')
+			fileid = sha1(prefixes[rawDomain] + rawPath).hexdigest()
+		except (UnicodeDecodeError, KeyError):
+			domain = domains.get(rawDomain)
+			if domain is None:
+				domain = domains[rawDomain] = text(rawDomain)
+			path = text(rawPath)
+			if type(domain) is unicode and type(path) is unicode:
+				prefixes[rawDomain] = rawDomain + '-'
+				fileid = sha1(prefixes[rawDomain] + rawPath).hexdigest()
+			else:
+				fileid = sha1((u'%s-%s' % (domain, path)).encode('utf-8')).hexdigest()
+
+		yield recordType((domain, path, linktarget, datahash, unknown1, mode, unknown2,
+			unknown3, userid, groupid, mtime, atime, ctime, filelength, flag, properties, fileid))
+
+	if stop is not None:
+		stop.append(offset)
+
+# a parallel parse splits the file in blocks of about the same size, and each worker looks
+# for the first record of its block: a domain name (HomeDomain, AppDomain-com.apple.x,
+# AppDomainGroup-...) after its length, followed by records that can be walked through
+_domainStart = re.compile(r'[\x00\x01][\x01-\xff](?=[A-Z][A-Za-z]*Domain)')
+_domainName = re.compile(r'[A-Z][A-Za-z]*Domain[A-Za-z]*(?:-|\Z)')
+
+def _isRecordStart(data, offset, count=8):
+	"""Whether count records (or all the ones up to the end of the file) follow offset,
+	all of them with a domain name"""
+	lengths = _stringLengths
+	fixedSize = _fixedFields.size
+	size = len(data)
+	try:
+		for x in xrange(count):
+			if offset == size:
+				return True
+			start = offset + 2
+			offset = start + lengths[data[offset:start]]
+			if offset > size or not _domainName.match(data[start:offset]):
+				return False
+			for x in xrange(4): # path, link target, data hash, unknown1
+				offset += 2 + lengths[data[offset:offset + 2]]
+			offset += fixedSize
+			if offset > size:
+				return False
+			for x in xrange(2 * ord(data[offset - 1])): # properties
+				offset += 2 + lengths[data[offset:offset + 2]]
+			if offset > size:
+				return False
+	except struct.error:
+		# a length cut by the end of the file
+		return False
+	return True
+
+def _recordStart(data, offset, end):
+	"""Return the offset of the first record starting between offset and end (give or
+	take the lookahead of a domain name), or None if none was found"""
+	match = _domainStart.search(data, offset, end + 256)
+	while match is not None and match.start() < end:
+		if _isRecordStart(data, match.start()):
+			return match.start()
+		match = _domainStart.search(data, match.start() + 1, end + 256)
+	return None
+
+def _decodeBlock(data, start, end, asRows):
+	"""Decode the records starting between start (the start of a record) and end, and
+	return (start, the offset following them, their _Block if asRows, or else the records
+	as plain tuples with their properties as a dict)"""
+	stop = []
+	records = _decodeRecords(data, start, end, {}, tuple, stop)
+	if asRows:
+		decoded = _blockRows(records)
+	else:
+		decoded = [record[:15] + (dict(record[15]), record[16]) for record in records]
+	return start, stop[0], decoded
+
+def _decodeBlockInWorker(args):
+	"""Decode a block of a .mbdb file (runs in a worker process), see _decodeBlock
+
+	Unless the block is the first one, decoding starts from the first record found in
+	it: None is returned if none was (or if that was not a record after all, as the
+	decoding failed), and the result is checked by the parent anyway. Rows are stored in
+	the database file given, and only the count and domains of the block returned; what
+	is returned is marshalled, much cheaper to send back to the parent process.
+	"""
+	fname, start, end, exact, asRows, database = args
+	with open(fname, 'rb') as f:
+		data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	try:
+		if not exact:
+			start = _recordStart(data, start, end)
+			if start is None:
+				return None
+		try:
+			start, stop, decoded = _decodeBlock(data, start, end, asRows)
+		except struct.error:
+			if exact:
+				raise
+			return None
+	finally:
+		data.close()
+	if asRows:
+		_writeBlock(database, decoded)
+		decoded = (decoded.count, decoded.domains)
+	return marshal.dumps((start, stop, decoded))
+
+def _classifyFiles(paths):
+	"""Return the type (from magic numbers) of each of the given files, None for the
+	files that can not be read (runs in the worker processes of ManifestMBDB.classify)"""
+	types = []
+	for path in paths:
+		try:
+			types.append(unicode(magic.file(path)))
+		except EnvironmentError:
+			types.append(None)
+	return types
+
+def cacheFileName(fname, cache_dir):
+	"""Return the name of the database caching the index of the given Manifest.mbdb"""
+	path = os.path.abspath(fname)
+	if isinstance(path, unicode):
+		path = path.encode('utf-8')
+	return os.path.join(cache_dir, hashlib.sha1(path).hexdigest() + '.sqlite')
+
+def _manifestSignature(fname):
+	"""Return what identifies a version of a Manifest.mbdb file, to check cached indexes"""
+	path = os.path.abspath(fname)
+	if not isinstance(path, unicode):
+		path = path.decode(sys.getfilesystemencoding() or 'utf-8')
+	info = os.stat(fname)
+	return {
+		u'schema_version': unicode(ManifestDatabase.schemaVersion),
+		u'mbdb_path': path,
+		u'mbdb_size': unicode(info.st_size),
+		u'mbdb_mtime': unicode(repr(info.st_mtime)),
+		u'mbdb_sha1': unicode(_contentHash(fname)),
+	}
+
+def _contentHash(fname, blockSize=1024*1024):
+	sha1 = hashlib.sha1()
+	with open(fname, 'rb') as f:
+		block = f.read(blockSize)
+		while block:
+			sha1.update(block)
+			block = f.read(blockSize)
+	return sha1.hexdigest()
+
+class ManifestTreeNode(object):
+	"""A node of the tree returned by ManifestMBDB.fileTree: a domain type, a domain, a path
+	or a file (kind), with its indice row (None for the nodes that have no record), parent
+	and children"""
+	__slots__ = ('name', 'record', 'parent', 'children', 'kind')
+
+	DOMAIN_TYPE = 'domain type'
+	DOMAIN = 'domain'
+	PATH = 'path'
+	FILE = 'file'
+
+	def __init__(self, name, record=None, parent=None, kind=None):
+		self.name = name
+		self.record = record
+		self.parent = parent
+		self.kind = kind
+		self.children = []
+		if parent is not None:
+			parent.children.append(self)
+
+	def ancestors(self):
+		"""Return the nodes above this one, from the root down to its parent"""
+		nodes = []
+		node = self.parent
+		while node is not None:
+			nodes.append(node)
+			node = node.parent
+		nodes.reverse()
+		return nodes
+
+	def walk(self, depth=0):
+		"""Yield (depth, node) for all the nodes under this one, depth first"""
+		for child in self.children:
+			yield depth, child
+			for item in child.walk(depth + 1):
+				yield item
+
+def _synchronized(method):
+	"""Run the decorated ManifestMBDB method holding the lock of the database"""
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		with self._lock:
+			return method(self, *args, **kwargs)
+	return wrapper
+
 class ManifestMBDB(object):
-	def __init__(self, fname, db_file=None, create_database=True):
+	def __init__(self, fname, db_file=None, create_database=True, processes=1, cache_dir=None, load=True):
+		"""Decode the given Manifest.mbdb file, and load it in a database (unless
+		create_database is False).
+
+		If the database is stored in a file (db_file, or a file in cache_dir named after the
+		manifest path) and it was already built from this same version of the manifest, it
+		is opened read-only and the manifest is not parsed at all.
+
+		With load False the database is only filled by a later call to load, which can run
+		in another thread: the database can be used from any thread, one query at a time.
+		"""
 		self.fname = fname
 
 		try:
 			with open(fname, 'rb') as f:
-				data = f.read()
+				header = f.read(6)
 		except IOError as e:
 			raise ManifestMBDBError(str(e))
 
-		header = data[:4]
-		if header != 'mbdb':
+		if len(header) < 6 or header[:4] != 'mbdb':
 			raise ManifestMBDBError(u'"%s" is not a valid mbdb file' % fname)
-		self.version = u'mbdb %s' % repr((ord(data[4]), ord(data[5])))
+		self.version = u'mbdb %s' % repr((ord(header[4]), ord(header[5])))
+
+		# records are only kept in memory if somebody asks for the whole list
+		self._records = None
+		# decoded domain names, so that all the records of a domain share the same string
+		self._domains = {}
+		# true if the database was reused from a previous session
+		self.cached = False
+		# what changed, if the database was updated from a previous version of the manifest
+		self.changes = None
+		# true once the database has been filled
+		self.loaded = False
+		self._processes = processes
+		self._lock = threading.RLock()
+		# held by the thread filling the database (see load), which only takes _lock a
+		# batch of records at a time
+		self._loadLock = threading.Lock()
 
 		if create_database:
-			if db_file:
-				self._db = ManifestDatabase.connect(db_file)
-			else:
-				self._db = ManifestDatabase.connect()
+			if cache_dir:
+				if not os.path.isdir(cache_dir):
+					os.makedirs(cache_dir)
+				db_file = cacheFileName(fname, cache_dir)
+			try:
+				self._db = ManifestDatabase.connect(db_file or ':memory:', check_same_thread=False)
+			except ManifestDatabaseError as e:
+				raise ManifestMBDBError(u'%s: %s' % (db_file, e))
+			if load:
+				self.load()
 		else:
 			self._db = None
 
-		offset = 6
-		dataLength = len(data)
-		self.records = []
-		while offset < dataLength:
-			record, offset = self._decodeRecord(data, offset)
-			self.records.append(record)
-			if create_database:
-				self._db.insertRecord(record, commit=False)
+	def load(self, progress=None, domainsLoaded=None):
+		"""Fill the database, if it was not already filled by the constructor.
 
-		if create_database:
-			self._db.commit()
+		progress, if given, is called with the number of records decoded so far every
+		progressStep records (it is not called at all if the cached database is reused).
+
+		While a new database is filled, the other methods can be called from other threads
+		between two batches of records: domainsLoaded, if given, is called with lists of
+		(domain type, domain) as soon as all their records are stored (see
+		ManifestDatabase.insertRecords). A cached or updated database is only reported once
+		ready, all its domains at once.
+		"""
+		with self._loadLock:
+			if not self.loaded:
+				self._loadDatabase(self._processes, progress, domainsLoaded)
+				self.loaded = True
+
+	progressStep = 1000
+
+	def _loadDatabase(self, processes, progress=None, domainsLoaded=None):
+		signature = _manifestSignature(self.fname)
+		with self._lock:
+			metadata = self._db.metadata()
+			if metadata == signature:
+				self.cached = True
+				self._db.execute(u'PRAGMA query_only = ON')
+
+		if not self.cached:
+			if all(metadata.get(key) == signature[key] for key in (u'mbdb_path', u'schema_version')):
+				# a newer version of the same manifest (iTunes updates backups in place)
+				records = self.iterRecords(processes)
+				if progress is not None:
+					records = self._reportProgress(records, progress)
+				with self._lock:
+					self.changes = self._db.updateRecords(records)
+			else:
+				# the rows are built with the records, by the worker processes if any
+				blocks = self._decodedBlocks(processes, True)
+				if progress is not None:
+					blocks = self._reportBlockProgress(blocks, progress)
+				with self._lock:
+					self._db.reset()
+				self._db.insertBlocks(blocks, lock=self._lock, domainsStored=domainsLoaded)
+				# the domains were reported as they were stored
+				domainsLoaded = None
+			with self._lock:
+				self._db.setMetadata(signature)
+
+		if domainsLoaded is not None:
+			domainsLoaded([(domainType, domain) for domainType in self.domainTypes()
+				for domain in self.domainTypeMembers(domainType)])
+
+	def _reportProgress(self, records, progress):
+		for count, record in enumerate(records, 1):
+			if count % self.progressStep == 0:
+				progress(count)
+			yield record
+
+	def _reportBlockProgress(self, blocks, progress):
+		count = 0
+		for block in blocks:
+			if (count + block.count) // self.progressStep > count // self.progressStep:
+				progress(count + block.count)
+			count += block.count
+			yield block
+
+	# size of the blocks of the file decoded at a time (by a worker process, if any)
+	blockSize = 1024 * 1024
+
+	def _mapFile(self):
+		try:
+			f = open(self.fname, 'rb')
+		except IOError as e:
+			raise ManifestMBDBError(str(e))
+		with f:
+			return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+	def iterRecords(self, processes=1, blockSize=None):
+		"""Decode the records of the .mbdb file one at a time, as they are read from disk
+
+		With processes other than 1 the records are decoded by a pool of worker processes
+		(None meaning one per cpu), in blocks of about blockSize bytes, and yielded in their
+		original order.
+		"""
+		if processes == 1:
+			# the decoding generator itself, not wrapped in another one (that would double
+			# the cost of going from a record to the next): the mapping is closed when it is
+			# released
+			data = self._mapFile()
+			return _decodeRecords(data, 6, len(data), self._domains)
+		return self._iterRecordsParallel(processes, blockSize)
+
+	def _iterRecordsParallel(self, processes, blockSize):
+		# each block comes back with strings of its own: the domains are interned again
+		# here, so that all the records of a domain share one string as in a serial parse
+		domains = {}
+		for records in self._decodedBlocks(processes, False, blockSize):
+			for record in records:
+				domain = domains.setdefault(record[0], record[0])
+				yield ManifestRecord((domain,) + record[1:15] + (_readOnlyProperties(record[15]), record[16]))
+
+	def _decodedBlocks(self, processes, asRows, blockSize=None):
+		"""Decode the .mbdb file a block of about blockSize bytes at a time, and yield for
+		each of them, in the order of the file, its _Block if asRows, or else its records
+		(see _decodeBlock). A _Block is only valid until the next one is asked for.
+
+		With processes other than 1 the blocks are decoded by a pool of worker processes,
+		each starting from the first record it finds in its block. A block that was not
+		decoded from where the previous one stopped (no record was found in it, or the
+		start found was not the one of a record) is decoded again here: the blocks cover
+		all the records once, whatever the workers find.
+		"""
+		data = self._mapFile()
+		size = len(data)
+		blockSize = blockSize or self.blockSize
+		starts = range(6, size, blockSize)
+
+		pool = None
+		directory = None
+		if processes != 1 and len(starts) > 1:
+			if asRows:
+				# where the workers store the rows of their blocks
+				directory = tempfile.mkdtemp(prefix='manifestmbdb-')
+			blocks = [(self.fname, start, min(start + blockSize, size), start == 6, asRows,
+				directory and os.path.join(directory, '%i.sqlite' % i)) for i, start in enumerate(starts)]
+			pool = multiprocessing.Pool(processes)
+			results = pool.imap(_decodeBlockInWorker, blocks)
+		else:
+			blocks = [(self.fname, start, min(start + blockSize, size), True, asRows, None) for start in starts]
+			results = itertools.repeat(None)
 
+		try:
+			stop = 6
+			for (fname, start, end, exact, asRows, database), result in itertools.izip(blocks, results):
+				if result is not None:
+					result = marshal.loads(result)
+				if result is None or result[0] != stop:
+					result = _decodeBlock(data, stop, end, asRows)
+				elif asRows:
+					count, domains = result[2]
+					result = result[:2] + (_Block(count, None, None, domains, database),)
+				stop = result[1]
+				yield result[2]
+				if database is not None and os.path.exists(database):
+					# stored by now
+					os.remove(database)
+			if pool is not None:
+				pool.close()
+		finally:
+			if pool is not None:
+				pool.terminate()
+				pool.join()
+			if directory is not None:
+				shutil.rmtree(directory, ignore_errors=True)
+			data.close()
+
+	@property
+	def records(self):
+		"""The list of all the decoded records (decodes the whole file on first access)"""
+		if self._records is None:
+			self._records = list(self.iterRecords())
+		return self._records
 	
 	def __list__(self):
 		return self.records
 
+	@_synchronized
 	def __len__(self):
-		return len(self.records)
+		if self._records is not None:
+			return len(self._records)
+		if self._db is not None:
+			cursor = self._db.cursor()
+			cursor.execute(u'SELECT COUNT(*) FROM indice')
+			count = cursor.fetchone()[0]
+			cursor.close()
+			return count
+		return sum(1 for record in self.iterRecords())
 
 	def __iter__(self):
-		return iter(self.records)
+		if self._records is not None:
+			return iter(self._records)
+		return self.iterRecords()
 
 	def __getitem__(self, key):
 		return self.records[key]
 
-	def realFileName(self, filename='', domaintype='', path=''):
-		"""Queries the database for the sha1 hash of the file given the arguments"""
+	# Queries ----------------------------------------------------------------------------------
+	# (the indexes in ManifestDatabase.createIndexes are designed around these, and
+	# explainQueries checks that none of them needs to scan a whole table)
+
+	# loose index scan: jumps from one domain type to the next one in the index
+	_domainTypesQuery = u'''
+		WITH RECURSIVE domain_types(domain_type) AS (
+			SELECT MIN(domain_type) FROM indice
+			UNION ALL
+			SELECT (SELECT MIN(domain_type) FROM indice WHERE indice.domain_type > domain_types.domain_type)
+			FROM domain_types WHERE domain_type IS NOT NULL
+		)
+		SELECT domain_type FROM domain_types WHERE domain_type IS NOT NULL
+	'''
+
+	# WITH RECURSIVE needs SQLite 3.8.3: older versions read the whole index instead of
+	# jumping from a domain type to the next
+	if sqlite3.sqlite_version_info < (3, 8, 3):
+		_domainTypesQuery = u'''
+			SELECT DISTINCT(domain_type)
+			FROM indice
+			ORDER BY domain_type ASC
+		'''
+
+	_domainTypeMembersQuery = u'''
+		SELECT DISTINCT(domain)
+		FROM indice
+		WHERE domain_type = ?
+		ORDER BY domain ASC
+	'''
+
+	_filePathsOfDomainQuery = u'''
+		SELECT DISTINCT(file_path)
+		FROM indice
+		WHERE domain_type = ? AND domain = ?
+		ORDER BY file_path ASC
+	'''
+
+	_directoriesOfDomainQuery = u'''
+		SELECT file_path, file_name
+		FROM indice
+		WHERE domain_type = ? AND domain = ? AND type = 'd' AND file_name != ''
+	'''
+
+	# used to be: SELECT file_name, filelen, id, type
+	_filesInDirQuery = u'''
+		SELECT *
+		FROM indice 
+		WHERE domain_type = ? AND domain = ? AND file_path = ?
+		ORDER BY file_name ASC
+	'''
+
+	# the whole table, in tree order (reads indice_tree from start to end, so it is not
+	# listed in explainQueries)
+	_fileTreeQuery = u'''
+		SELECT *
+		FROM indice
+		ORDER BY domain_type, domain, file_path, file_name
+	'''
+
+	# files that were never classified (or could not be read: mime is NULL, or '' in
+	# older databases), or whose content changed since
+	_unclassifiedQuery = u'''
+		SELECT id, fileid, datahash
+		FROM indice
+		WHERE type = '-' AND (mime IS NULL OR mime = '' OR mime_datahash IS NOT datahash)
+	'''
+
+	_fileTypesQuery = u'''
+		SELECT mime, COUNT(*)
+		FROM indice
+		WHERE mime > ''
+		GROUP BY mime
+	'''
+
+	_filesOfTypeQuery = u'''
+		SELECT *
+		FROM indice
+		WHERE mime = ?
+		ORDER BY domain_type, domain, file_path, file_name
+	'''
+
+	_fileInformationQuery = u'''
+		SELECT * FROM indice 
+		WHERE id = ?
+	'''
+
+	_filePropertiesQuery = u'''
+		SELECT name, value
+		FROM properties
+		WHERE fileid = ?
+	'''
+
+	@staticmethod
+	def _realFileNameQuery(filename='', domaintype='', path=''):
 		query = u'SELECT fileid FROM indice'
 
 		values = (filename, domaintype, path)
@@ -195,6 +1252,27 @@ class ManifestMBDB(object):
 			query = u' WHERE '.join([query, where_clause])
 
 		values = [v for v in values if v]
+		return (query, values)
+
+	@staticmethod
+	def _fileIdQuery(filename, filePath):
+		query = u'''
+			SELECT id
+			FROM indice
+		'''
+		fields = [u'file_name', u'file_path']
+		values = [filename, filePath]
+		where_clause = u' AND '.join([u'%s = ?' % k for k, v in zip(fields, values) if v])
+		if where_clause:
+			query = u' WHERE '.join([query, where_clause])
+
+		values = [f for f in values if f]
+		return (query, values)
+
+	@_synchronized
+	def realFileName(self, filename='', domaintype='', path=''):
+		"""Queries the database for the sha1 hash of the file given the arguments"""
+		query, values = self._realFileNameQuery(filename, domaintype, path)
 
 		cursor = self._db.cursor()
 		cursor.execute(query, values);
@@ -207,93 +1285,249 @@ class ManifestMBDB(object):
 			print(u'ERROR: could not find file')
 			return ''	
 	
+	@_synchronized
 	def domainTypes(self):
 		"""Return a list of distinct domain types"""
 		cursor = self._db.cursor()
-		cursor.execute(u'SELECT DISTINCT(domain_type) FROM indice ORDER BY domain_type ASC');
+		cursor.execute(self._domainTypesQuery);
 		domain_types = [x[0] for x in list(cursor)]
 		cursor.close()
 		return domain_types
 
+	@_synchronized
 	def domainTypeMembers(self, domainType):
 		"""Return a list of distinct domain names of the given domain type"""
-		query = u'''
-			SELECT DISTINCT(domain)
-			FROM indice
-			WHERE domain_type = ?
-			ORDER BY domain ASC
-		'''
 		cursor = self._db.cursor()
-		cursor.execute(query, (domainType,))
+		cursor.execute(self._domainTypeMembersQuery, (domainType,))
 		domain_members = [x[0] for x in list(cursor)]
 		cursor.close()
 		return domain_members
 
 
+	@_synchronized
 	def filePathsOfDomain(self, domainType, domainName):
 		"""Return a list of all the files under the given domain"""
-		query = u'''
-			SELECT DISTINCT(file_path)
-			FROM indice
-			WHERE domain_type = ? AND domain = ?
-			ORDER BY file_path ASC
-		'''
 		cursor = self._db.cursor()
-		cursor.execute(query, (domainType, domainName))
+		cursor.execute(self._filePathsOfDomainQuery, (domainType, domainName))
 		paths = [x[0] for x in list(cursor)]
 		cursor.close()
 		return paths
 
 
+	@_synchronized
+	def directoriesOfDomain(self, domainType, domainName):
+		"""Return the set of the full paths of the directories of the given domain"""
+		cursor = self._db.cursor()
+		cursor.execute(self._directoriesOfDomainQuery, (domainType, domainName))
+		directories = set(u'/'.join([path, name]) if path else name for path, name in cursor)
+		cursor.close()
+		return directories
+
+
+	@_synchronized
 	def filesInDir(self, domainType, domainName, filePath):
 		"""Return a list of file information for the files in the given category"""
-		# used to be: SELECT file_name, filelen, id, type
-		query = u'''
-			SELECT *
-			FROM indice 
-			WHERE domain_type = ? AND domain = ? AND file_path = ?
-			ORDER BY file_name ASC
-		'''
 		cursor = self._db.cursor()
-		cursor.execute(query, (domainType, domainName, filePath))
+		cursor.execute(self._filesInDirQuery, (domainType, domainName, filePath))
 		files = cursor.fetchall()
 		cursor.close()
 		return files
 
 
+	def fileTree(self):
+		"""Return the whole content of the backup as a tree of ManifestTreeNode, built
+		from a single query.
+
+		The children of the returned root are the domain types, then come the domains
+		(files of an unnamed domain sit directly under their domain type), then the paths
+		holding files that have no directory record of their own, and the files. The
+		files of a directory are the children of the directory's node. The record with
+		an empty file name of a path (or domain) is the record of the path's node.
+		"""
+		root = ManifestTreeNode(None)
+		for domainTypeNode in self.iterFileTree(root):
+			pass
+		return root
+
+	def iterFileTree(self, root, batchSize=1000):
+		"""Build the tree of fileTree under the given root, yielding each domain type
+		node as soon as it is complete.
+
+		The lock of the database is only held while reading each batch of rows, so other
+		threads can run queries while the tree is built.
+		"""
+		domainType = domain = path = None
+		domainTypeNode = None
+		cursor = self._db.cursor()
+		with self._lock:
+			cursor.execute(self._fileTreeQuery)
+		while True:
+			with self._lock:
+				rows = cursor.fetchmany(batchSize)
+			if not rows:
+				break
+			for row in rows:
+				if row['domain_type'] != domainType:
+					if domainTypeNode is not None:
+						yield domainTypeNode
+					domainType = row['domain_type']
+					domainTypeNode = ManifestTreeNode(domainType, parent=root, kind=ManifestTreeNode.DOMAIN_TYPE)
+					domain = None
+				if row['domain'] != domain:
+					domain = row['domain']
+					if domain:
+						domainNode = ManifestTreeNode(domain, parent=domainTypeNode, kind=ManifestTreeNode.DOMAIN)
+					else:
+						domainNode = domainTypeNode
+					# the nodes of the directories, by full path (a directory always sorts
+					# before its content)
+					directories = {}
+					path = None
+				if row['file_path'] != path:
+					path = row['file_path']
+					if path:
+						pathNode = directories.get(path)
+						if pathNode is None:
+							pathNode = ManifestTreeNode(path, parent=domainNode, kind=ManifestTreeNode.PATH)
+					else:
+						pathNode = domainNode
+
+				name = row['file_name']
+				if name:
+					node = ManifestTreeNode(name, row, pathNode, ManifestTreeNode.FILE)
+					if row['type'] == u'd':
+						directories[u'/'.join([path, name]) if path else name] = node
+				else:
+					pathNode.record = row
+		with self._lock:
+			cursor.close()
+		if domainTypeNode is not None:
+			yield domainTypeNode
+
+	@contextlib.contextmanager
+	def _writable(self):
+		# a cached database is opened read-only, but what is computed from the files of
+		# the backup (types, hashes) is stored in it too
+		with self._lock:
+			queryOnly = self._db.execute(u'PRAGMA query_only').fetchone()[0]
+			self._db.execute(u'PRAGMA query_only = OFF')
+			try:
+				yield
+			finally:
+				self._db.execute(u'PRAGMA query_only = %d' % queryOnly)
+
+	def _fileStat(self, fileid):
+		st = os.stat(os.path.join(os.path.dirname(self.fname), fileid))
+		return st.st_size, st.st_mtime
+
+	def fileHashes(self, fileid, hashFile=hashutils.hashFile):
+		"""Return the hashes of the file of the backup, as a dict by hash name: they are
+		computed only the first time, or if the file changed, by hashFile (called with the
+		path of the file, it returns the hashes of hashutils.hashNames; callers that read
+		the whole file anyway can compute them along)"""
+		stat = self._fileStat(fileid)
+		with self._lock:
+			hashes = self._db.cachedHashes(fileid, *stat)
+		if hashes is None:
+			hashes = hashFile(os.path.join(os.path.dirname(self.fname), fileid))
+			with self._writable():
+				self._db.cacheHashes(fileid, *(stat + (hashes,)))
+		return hashes
+
+	def classify(self, processes=None, batchSize=200, progress=None):
+		"""Identify the type (from magic numbers) of the regular files of the backup, and
+		store it in the mime column of indice, using a pool of worker processes (None
+		meaning one per cpu, 1 meaning no pool).
+
+		Files already classified are skipped, unless their data hash changed (or their
+		row was updated from a newer manifest); the ones that could not be read (missing
+		from the backup) are tried again on the next call. Results are committed a batch
+		of files at a time, so an interrupted pass goes on from where it stopped. progress,
+		if given, is called with the number of files classified so far and the number to
+		classify.
+		Returns that number.
+		"""
+		backupPath = os.path.dirname(self.fname)
+		with self._lock:
+			cursor = self._db.cursor()
+			cursor.execute(self._unclassifiedQuery)
+			rows = [(row['id'], row['fileid'], row['datahash']) for row in cursor]
+			cursor.close()
+		batches = [rows[i:i + batchSize] for i in range(0, len(rows), batchSize)]
+		paths = ([os.path.join(backupPath, fileid) for index, fileid, datahash in batch] for batch in batches)
+
+		pool = None
+		if processes == 1:
+			results = itertools.imap(_classifyFiles, paths)
+		else:
+			pool = multiprocessing.Pool(processes)
+			results = pool.imap(_classifyFiles, paths)
+
+		done = 0
+		try:
+			for batch, types in itertools.izip(batches, results):
+				with self._writable():
+					# the files that could not be read are left unclassified, to be tried
+					# again by the next pass
+					self._db.executemany(u'UPDATE indice SET mime = ?, mime_datahash = ? WHERE id = ?',
+						[(mime, datahash if mime is not None else None, index)
+							for (index, fileid, datahash), mime in zip(batch, types)])
+					self._db.commit()
+				done += len(batch)
+				if progress is not None:
+					progress(done, len(rows))
+			if pool is not None:
+				pool.close()
+		finally:
+			if pool is not None:
+				pool.terminate()
+				pool.join()
+		return len(rows)
+
+	@_synchronized
+	def fileIdMap(self):
+		"""Return a dict mapping the name of each file in the backup directory (fileid) to the
+		(type, datahash) of its record"""
+		cursor = self._db.cursor()
+		cursor.execute(u'SELECT fileid, type, datahash FROM indice')
+		fileIds = dict((row[0], (row[1], row[2])) for row in cursor)
+		cursor.close()
+		return fileIds
+
+	@_synchronized
+	def fileTypes(self):
+		"""Return the list of (type, number of files) of the classified files"""
+		cursor = self._db.cursor()
+		cursor.execute(self._fileTypesQuery)
+		types = [(row[0], row[1]) for row in cursor]
+		cursor.close()
+		return types
+
+	@_synchronized
+	def filesOfType(self, mime):
+		"""Return the file information of the files of the given type (see classify)"""
+		cursor = self._db.cursor()
+		cursor.execute(self._filesOfTypeQuery, (mime,))
+		files = cursor.fetchall()
+		cursor.close()
+		return files
+
+	@_synchronized
 	def fileInformation(self, item_id):
 		"""Return the file information for the file with the given id"""
-		query = u'''
-			SELECT * FROM indice 
-			WHERE id = ?
-		'''
 		cursor = self._db.cursor()
-		cursor.execute(query, (item_id,))
+		cursor.execute(self._fileInformationQuery, (item_id,))
 		data = dict(cursor.fetchone())
-		query = u'''
-			SELECT name, value
-			FROM properties
-			WHERE fileid = ?
-		'''
-		cursor.execute(query, (item_id,))
+		cursor.execute(self._filePropertiesQuery, (item_id,))
 		properties = dict([(row['name'], row['value']) for row in cursor])
 		cursor.close()
 		data['properties'] = properties
 		return data
 
+	@_synchronized
 	def fileId(self, filename, filePath):
 		"""Return the file id of the file matching the criteria, None if not found"""
-		query = u'''
-			SELECT id
-			FROM indice
-		'''
-		fields = [u'file_name', u'file_path']
-		values = [filename, filePath]
-		where_clause = u' AND '.join([u'%s = ?' % k for k, v in zip(fields, values) if v])
-		if where_clause:
-			query = u' WHERE '.join([query, where_clause])
-
-		values = [f for f in values if f]
+		query, values = self._fileIdQuery(filename, filePath)
 		cursor = self._db.cursor()
 		cursor.execute(query, values)
 		row = cursor.fetchone()
@@ -302,77 +1536,156 @@ class ManifestMBDB(object):
 			return row[0]
 		return None
 
+	@_synchronized
+	def explainQueries(self):
+		"""Return the query plans of the queries run by the UI and the plugins.
 
-	def _decodeRecord(self, data, offset):
-		"""Decode and return a single record from the .mbdb file"""
-		record = {}
-		record['domain'], offset     = self._decodeString(data, offset)
-		record['path'], offset       = self._decodeString(data, offset)
-		record['linktarget'], offset = self._decodeString(data, offset)
-		record['datahash'], offset   = self._decodeSha1(data, offset)
-		record['unknown1'], offset   = self._decodeString(data, offset)
-		record['mode'], offset       = self._decodeUint16(data, offset)
-		record['unknown2'], offset   = self._decodeUint32(data, offset)
-		record['unknown3'], offset   = self._decodeUint32(data, offset)
-		record['userid'], offset     = self._decodeUint32(data, offset)
-		record['groupid'], offset    = self._decodeUint32(data, offset)
-		record['mtime'], offset      = self._decodeUint32(data, offset)
-		record['atime'], offset      = self._decodeUint32(data, offset)
-		record['ctime'], offset      = self._decodeUint32(data, offset)
-		record['filelength'], offset = self._decodeUint64(data, offset)
-		record['flag'], offset       = self._decodeUint8(data, offset)
-		numProperties, offset = self._decodeUint8(data, offset)
-		record['properties'] = {}
-		for x in range(numProperties):
-			prop, offset = self._decodeString(data, offset)
-			value, offset = self._decodeString(data, offset)
-			record['properties'][prop] = value
-		sha1 = hashlib.sha1()
-		sha1.update((u'%s-%s' % (record['domain'], record['path'])).encode('utf-8'))
-		record['fileid'] = sha1.hexdigest()	
-		return (record, offset)
-
-	def _decodeUint8(self, data, offset):
-		num = struct.unpack('>B', data[offset:offset+1])[0]
-		return (num, offset + 1)
-
-	def _decodeUint16(self, data, offset):
-		num = struct.unpack('>H', data[offset:offset+2])[0]
-		return (num, offset + 2)
-
-	def _decodeUint32(self, data, offset):
-		num = struct.unpack('>I', data[offset:offset+4])[0]
-		return (num, offset + 4)
-
-	def _decodeUint64(self, data, offset):
-		num = struct.unpack('>Q', data[offset:offset+8])[0]
-		return (num, offset + 8)
-
-	def _decodeString(self, data, offset):
-		if data[offset:offset+2].encode('hex') == 'ffff': #empty string
-			return (u'', offset + 2)
-		length, offset = self._decodeUint16(data, offset)
-		string = data[offset:offset+length]
-		try:
-			string = string.decode('utf-8')
-		except UnicodeDecodeError:
-			string = string.encode('hex').encode('utf-8')
-		return (string, offset + length)
-
-	def _decodeSha1(self, data, offset):
-		if data[offset:offset+2].encode('hex') == 'ffff': #empty string
-			return (u'', offset + 2)
-		length, offset = self._decodeUint16(data, offset)
-		string = data[offset:offset+length].encode('hex').encode('utf-8')
-		return (string, offset + length)
-		
+		Returns a list of (description, plan, fullScan) tuples, where plan is the list of
+		steps from EXPLAIN QUERY PLAN and fullScan tells whether any step scans a whole table.
+		"""
+		queries = [
+			(u'domainTypes', self._domainTypesQuery, ()),
+			(u'domainTypeMembers', self._domainTypeMembersQuery, (u'AppDomain',)),
+			(u'filePathsOfDomain', self._filePathsOfDomainQuery, (u'AppDomain', u'com.apple.x')),
+			(u'directoriesOfDomain', self._directoriesOfDomainQuery, (u'AppDomain', u'com.apple.x')),
+			(u'filesInDir', self._filesInDirQuery, (u'HomeDomain', u'', u'Library')),
+			(u'fileTypes', self._fileTypesQuery, ()),
+			(u'filesOfType', self._filesOfTypeQuery, (u'data/sqlite',)),
+			(u'fileInformation', self._fileInformationQuery, (1,)),
+			(u'cachedHashes', self._db._cachedHashesQuery, (u'x', 1, 1.0)),
+			(u'fileInformation (properties)', self._filePropertiesQuery, (1,)),
+			(u'realFileName(filename)', ) + self._realFileNameQuery(u'x.db'),
+			(u'realFileName(filename, domaintype)', ) + self._realFileNameQuery(u'x.db', u'HomeDomain'),
+			(u'realFileName(filename, domaintype, path)', ) + self._realFileNameQuery(u'x.db', u'HomeDomain', u'Library'),
+			(u'fileId(filename)', ) + self._fileIdQuery(u'x.db', None),
+			(u'fileId(filename, path)', ) + self._fileIdQuery(u'x.db', u'Library'),
+		]
+
+		plans = []
+		cursor = self._db.cursor()
+		for description, query, values in queries:
+			cursor.execute(u'EXPLAIN QUERY PLAN ' + query, values)
+			plan = [row[-1] for row in cursor]
+			# any SCAN of a table reads all its rows (or all the rows of an index), and so
+			# does a SEARCH that can not use an index
+			fullScan = False
+			for step in plan:
+				match = re.match(u'(SCAN|SEARCH) (TABLE )?(indice|properties)\\b', step)
+				if match and (match.group(1) == u'SCAN' or u' USING ' not in step):
+					fullScan = True
+			plans.append((description, plan, fullScan))
+		cursor.close()
+		return plans
+
+
+# synthetic manifests, to check the query plans without a backup --------------------------------
+
+def _mbdbString(string):
+	if not string:
+		return '\xff\xff'
+	return _uint16.pack(len(string)) + string
+
+def writeSyntheticManifest(fname, count=5000):
+	"""Write a Manifest.mbdb of count made up records, spread over a few domain types,
+	many app domains and nested directories (only the records, there are no files)"""
+	domains = ['HomeDomain', 'RootDomain', 'MediaDomain', 'WirelessDomain', 'SystemPreferencesDomain']
+	domains += ['AppDomain-com.example.app%i' % i for i in xrange(50)]
+	with open(fname, 'wb') as f:
+		f.write('mbdb\x05\x00')
+		for i in xrange(count):
+			domain = domains[i % len(domains)]
+			path = '/'.join(['Library', 'dir%i' % (i % 7), 'sub%i' % (i % 3)][:i % 4])
+			if i % 5 == 0:
+				# a directory
+				mode, name, datahash = 0x41ed, 'dir%i' % (i % 7), ''
+			else:
+				mode, name, datahash = 0x81a4, 'file%i.db' % i, hashlib.sha1(str(i)).digest()
+			f.write(_mbdbString(domain) + _mbdbString('/'.join([path, name]) if path else name))
+			f.write(_mbdbString('') + _mbdbString(datahash) + _mbdbString(''))
+			f.write(_fixedFields.pack(mode, 0, i, 501, 501, 1300000000, 1300000000, 1300000000, i * 100, 4, 1))
+			f.write(_mbdbString('com.apple.property') + _mbdbString('value%i' % i))
+
+def checkQueryPlans(count=5000):
+	"""Build the database of a synthetic manifest of count records, and return the
+	(description, plan) of the queries of explainQueries that do not search an index
+	(an empty list if all of them do)"""
+	directory = tempfile.mkdtemp()
+	try:
+		fname = os.path.join(directory, 'Manifest.mbdb')
+		writeSyntheticManifest(fname, count)
+		mbdb = ManifestMBDB(fname)
+		failures = []
+		for description, plan, fullScan in mbdb.explainQueries():
+			searches = [step for step in plan if re.match(u'SEARCH (TABLE )?\\w+ USING ', step)]
+			if fullScan or not searches:
+				failures.append((description, plan))
+		mbdb._db.close()
+		return failures
+	finally:
+		shutil.rmtree(directory)
+
+def benchmarkLoad(count=100000, processes=None):
+	"""Load the database of a synthetic manifest of count records serially, then with
+	processes worker processes (None meaning one per cpu), and return the times of both
+	as (wall time, cpu time of this process, cpu time of the workers), and whether the
+	databases are the same.
+
+	The cpu time of this process is the part of the parallel load that is not spread
+	over the workers: however many cpus, the parallel load takes at least that long."""
+	directory = tempfile.mkdtemp()
+	try:
+		fname = os.path.join(directory, 'Manifest.mbdb')
+		writeSyntheticManifest(fname, count)
+		times = []
+		tables = []
+		for j in (1, processes):
+			start, cpu = time.time(), os.times()
+			mbdb = ManifestMBDB(fname, processes=j)
+			end = os.times()
+			times.append((time.time() - start, sum(end[:2]) - sum(cpu[:2]), sum(end[2:4]) - sum(cpu[2:4])))
+			tables.append([mbdb._db.execute(u'SELECT * FROM %s ORDER BY id' % table).fetchall()
+				for table in (u'indice', u'properties')])
+			mbdb._db.close()
+		return times[0], times[1], tables[0] == tables[1]
+	finally:
+		shutil.rmtree(directory)
 
 if __name__ == '__main__':
 	import os, sys
+
+	# -s: check the query plans of the UI queries on a synthetic manifest (no backup needed)
+	if '-s' in sys.argv[1:]:
+		failures = checkQueryPlans()
+		for description, plan in failures:
+			print u'%s does not search an index:' % description
+			for step in plan:
+				print u'    %s' % step
+		print u'SQLite %s: %s' % (sqlite3.sqlite_version, u'%i queries without an index' % len(failures) if failures else u'all the queries search an index')
+		sys.exit(1 if failures else 0)
+
+	# -b [records [processes]]: time the loading of a synthetic manifest, serial and parallel
+	if '-b' in sys.argv[1:]:
+		args = [int(arg) for arg in sys.argv[sys.argv.index('-b') + 1:]]
+		count = args[0] if args else 100000
+		processes = args[1] if len(args) > 1 else multiprocessing.cpu_count()
+		serial, parallel, same = benchmarkLoad(count, processes)
+		print u'%i records, %i cpus' % (count, multiprocessing.cpu_count())
+		print u'serial: %.2f s' % serial[0]
+		print u'%i processes: %.2f s, cpu %.2f s in this process and %.2f s in the workers' % (
+			processes, parallel[0], parallel[1], parallel[2])
+		print u'    with one cpu per worker: %.2f s or more, at best %.1fx faster than serial' % (
+			max(parallel[1], parallel[2] / processes), serial[0] / max(parallel[1], parallel[2] / processes))
+		print u'same database: %s' % same
+		sys.exit(0 if same else 1)
+
 	backup_folder = os.path.join(os.path.expanduser(u'~'), u'Library/Application Support/MobileSync/Backup/')
 	backups = sorted(os.listdir(backup_folder), key=lambda x: os.path.getmtime(os.path.join(backup_folder, x)))
 
-	if len(sys.argv) == 2 and sys.argv[1] == '-f':
+	# -f: use the most recent backup
+	# -e: print the query plans of the UI queries, fail if any of them scans a whole table
+	# -t: print the tree of the backup content
+	# -k: classify the files of the backup, print the number of files of each type
+	if '-f' in sys.argv[1:]:
 		backup = backups[-1]
 	else:
 		for i, f in enumerate(backups):
@@ -394,8 +1707,31 @@ if __name__ == '__main__':
 		else:
 			backup = backups[-1]
 
+	if '-k' in sys.argv[1:]:
+		mbdb = ManifestMBDB(os.path.join(backup_folder, backup, u'Manifest.mbdb'))
+		mbdb.classify()
+		for mime, count in mbdb.fileTypes():
+			print u'%6i %s' % (count, mime)
+		sys.exit(0)
+
+	if '-t' in sys.argv[1:]:
+		mbdb = ManifestMBDB(os.path.join(backup_folder, backup, u'Manifest.mbdb'))
+		for depth, node in mbdb.fileTree().walk():
+			print u'%s%s' % (u'    ' * depth, node.name)
+		sys.exit(0)
+
+	if '-e' in sys.argv[1:]:
+		mbdb = ManifestMBDB(os.path.join(backup_folder, backup, u'Manifest.mbdb'))
+		fullScans = 0
+		for description, plan, fullScan in mbdb.explainQueries():
+			print u'%s%s' % (description, u' (FULL SCAN)' if fullScan else u'')
+			for step in plan:
+				print u'    %s' % step
+			fullScans += fullScan
+		sys.exit(1 if fullScans else 0)
+
 	mbdb = ManifestMBDB(os.path.join(backup_folder, backup, u'Manifest.mbdb'), create_database=False)
 	print mbdb.version
 
-	for rec in sorted(mbdb, key = lambda x: x['domain'] + x['path']):
+	for rec in mbdb.iterRecords():
 		print rec['domain'], rec['path'], rec['linktarget'], rec['userid'], rec['groupid'], oct(rec['mode']), rec['datahash'], len(rec['properties'])
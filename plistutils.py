@@ -7,139 +7,544 @@
  Released under MIT licence
 
  plistutils.plist provides general functions to deal with plist files
- converted into xml format
+ converted into xml format, and a decoder for binary plist files
 
 '''
 
-import os, sys, subprocess
+import os, sys, re, struct, binascii, base64, datetime, plistlib, mmap, collections
+import xml.etree.cElementTree as ElementTree
+import cPickle
 
 # ------------------------------------------------------------------------------------------------------------------------
 
-# reads a DICT node and returns a python dictionary with key-value pairs
-def readDict(dictNode):
-	ritorno = {}
-	
-	# check if it really is a dict node
-	if (dictNode.localName != "dict"):
-		print("Node under test is not a dict (it is more likely a \"%s\")."%node.localName)
-		return ritorno
-	
-	nodeKey = None
-	for node in dictNode.childNodes:
-		if (node.nodeType == node.TEXT_NODE): continue
-		
-		if (nodeKey is None):
-			nodeKeyElement = node.firstChild
-			if (nodeKeyElement is None):
-				nodeKey = "-"
-			else:
-				nodeKey = node.firstChild.toxml()
-		else:
-			ritorno[nodeKey] = node
-			nodeKey = None
-	
-	return ritorno
+# binary plist (bplist00) decoding ---------------------------------------------------------------------------
+
+class BinaryPlistError(Exception):
+	pass
+
+# seconds between the unix epoch and the reference date of binary plists (2001-01-01)
+_appleEpoch = datetime.datetime(2001, 1, 1)
+
+# offset size, object reference size, number of objects, top object, offset table offset
+_trailer = struct.Struct('>6xBBQQQ')
+
+class BinaryPlistDecoder(object):
+	"""Decodes the objects of a binary plist held in a string (or any buffer supporting
+	slicing, such as a mmap) into native python objects: dict, list, str (ascii strings)
+	or unicode, int or long, float, bool, None, datetime.datetime and plistlib.Data.
+	UIDs (used by NSKeyedArchiver) are decoded as {'CF$UID': uid}, as plutil shows them.
+
+	With lazy True, dicts and arrays are decoded as PlistDict and PlistArray proxies,
+	which only decode their items when they are accessed.
+	"""
+
+	def __init__(self, data, lazy=False):
+		self.data = data
+		self.lazy = lazy
+		if len(data) < 40 or data[:8] != 'bplist00':
+			raise BinaryPlistError('not a binary plist (or unsupported version)')
+		self.offsetSize, self.refSize, self.numObjects, self.topObject, tableOffset = \
+			_trailer.unpack(data[-32:])
+		if self.topObject >= self.numObjects or tableOffset + self.numObjects * self.offsetSize > len(data) - 32:
+			raise BinaryPlistError('corrupted binary plist trailer')
+		self.tableOffset = tableOffset
+		# objects being decoded, to refuse reference loops in corrupted files
+		self._decoding = set()
+
+	def _readInts(self, offset, size, count):
+		raw = self.data[offset:offset + size * count]
+		if len(raw) != size * count:
+			raise BinaryPlistError('truncated binary plist')
+		if size in (1, 2, 4, 8):
+			return struct.unpack('>%i%s' % (count, {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}[size]), raw)
+		return [int(binascii.hexlify(raw[i:i + size]), 16) for i in range(0, len(raw), size)]
+
+	def decode(self):
+		"""Return the top object of the plist"""
+		return self.objectAt(self.topObject)
+
+	def objectAt(self, ref):
+		"""Return the object with the given reference"""
+		if ref >= self.numObjects:
+			raise BinaryPlistError('object reference out of range: %i' % ref)
+		if ref in self._decoding:
+			raise BinaryPlistError('object reference loop at %i' % ref)
+		self._decoding.add(ref)
+		try:
+			return self._decodeObject(self._readInts(self.tableOffset + ref * self.offsetSize, self.offsetSize, 1)[0])
+		except (struct.error, ValueError, OverflowError) as e:
+			raise BinaryPlistError('invalid object %i: %s' % (ref, e))
+		finally:
+			self._decoding.discard(ref)
+
+	def _length(self, info, offset):
+		# the length of a variable size object, either in the marker or in the following int
+		if info != 0xF:
+			return info, offset
+		marker = ord(self.data[offset])
+		if marker >> 4 != 0x1:
+			raise BinaryPlistError('invalid object length at offset %i' % offset)
+		size = 1 << (marker & 0xF)
+		return self._readInts(offset + 1, size, 1)[0], offset + 1 + size
+
+	def _bytes(self, offset, length):
+		raw = self.data[offset:offset + length]
+		if len(raw) != length:
+			raise BinaryPlistError('truncated object at offset %i' % offset)
+		return raw
+
+	def _refs(self, offset, count):
+		return self._readInts(offset, self.refSize, count)
+
+	def _decodeObject(self, offset):
+		marker = ord(self.data[offset])
+		kind, info = marker >> 4, marker & 0xF
+		offset += 1
+
+		if kind == 0x0:
+			if info == 0x8:
+				return False
+			if info == 0x9:
+				return True
+			return None
+		if kind == 0x1:
+			raw = self._bytes(offset, 1 << info)
+			value = int(binascii.hexlify(raw), 16)
+			# 8 and 16 byte integers are signed
+			if len(raw) >= 8 and value >= 1 << (8 * len(raw) - 1):
+				value -= 1 << (8 * len(raw))
+			return value
+		if kind == 0x2:
+			size = 1 << info
+			if size not in (4, 8):
+				raise BinaryPlistError('invalid real size %i' % size)
+			return struct.unpack('>f' if size == 4 else '>d', self._bytes(offset, size))[0]
+		if kind == 0x3:
+			seconds = struct.unpack('>d', self._bytes(offset, 8))[0]
+			return _appleEpoch + datetime.timedelta(seconds=seconds)
+		if kind == 0x4:
+			length, offset = self._length(info, offset)
+			return plistlib.Data(self._bytes(offset, length))
+		if kind == 0x5:
+			length, offset = self._length(info, offset)
+			raw = self._bytes(offset, length)
+			try:
+				raw.decode('ascii')
+				return raw
+			except UnicodeDecodeError:
+				return raw.decode('latin-1')
+		if kind == 0x6:
+			length, offset = self._length(info, offset)
+			return self._bytes(offset, 2 * length).decode('utf-16-be')
+		if kind == 0x7:
+			length, offset = self._length(info, offset)
+			return self._bytes(offset, length).decode('utf-8')
+		if kind == 0x8:
+			return {'CF$UID': int(binascii.hexlify(self._bytes(offset, info + 1)), 16)}
+		if kind in (0xA, 0xB, 0xC):
+			length, offset = self._length(info, offset)
+			if self.lazy:
+				return PlistArray(self, offset, length)
+			return [self.objectAt(ref) for ref in self._refs(offset, length)]
+		if kind == 0xD:
+			length, offset = self._length(info, offset)
+			if self.lazy:
+				return PlistDict(self, offset, length)
+			keys = self._refs(offset, length)
+			values = self._refs(offset + length * self.refSize, length)
+			return dict((self.objectAt(key), self.objectAt(value)) for key, value in zip(keys, values))
+
+		raise BinaryPlistError('unknown object type 0x%x at offset %i' % (marker, offset - 1))
+
+class PlistArray(collections.Sequence):
+	"""An array of a lazily decoded binary plist: items are decoded on each access"""
+
+	def __init__(self, decoder, offset, length):
+		self._decoder = decoder
+		self._offset = offset
+		self._length = length
+
+	def __len__(self):
+		return self._length
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(self._length))]
+		if index < 0:
+			index += self._length
+		if not 0 <= index < self._length:
+			raise IndexError('plist array index out of range')
+		ref = self._decoder._refs(self._offset + index * self._decoder.refSize, 1)[0]
+		return self._decoder.objectAt(ref)
+
+	def __repr__(self):
+		return '<PlistArray of %i items>' % self._length
+
+class PlistDict(collections.Mapping):
+	"""A dict of a lazily decoded binary plist: the keys are decoded on first access,
+	the values on each access"""
+
+	def __init__(self, decoder, offset, length):
+		self._decoder = decoder
+		self._offset = offset
+		self._length = length
+		self._valueRefs = None
+
+	def _index(self):
+		# key -> reference of the value
+		if self._valueRefs is None:
+			decoder = self._decoder
+			keys = decoder._refs(self._offset, self._length)
+			values = decoder._refs(self._offset + self._length * decoder.refSize, self._length)
+			self._valueRefs = dict((decoder.objectAt(key), value) for key, value in zip(keys, values))
+		return self._valueRefs
+
+	def __len__(self):
+		return self._length
+
+	def __iter__(self):
+		return iter(self._index())
+
+	def __contains__(self, key):
+		return key in self._index()
+
+	def __getitem__(self, key):
+		return self._decoder.objectAt(self._index()[key])
+
+	def __repr__(self):
+		return '<PlistDict of %i items>' % self._length
+
+# reads a binary plist file and returns its top object as native python objects
+def readBinaryPlist(filename):
+	with open(filename, 'rb') as fh:
+		data = fh.read()
+	return BinaryPlistDecoder(data).decode()
+
+# opens a binary plist file and returns its top object, decoding its content only when
+# it is accessed (dicts and arrays are PlistDict and PlistArray); the file is memory
+# mapped, and stays open as long as any of its objects is referenced
+def openBinaryPlist(filename):
+	with open(filename, 'rb') as fh:
+		try:
+			data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+		except (ValueError, EnvironmentError) as e:
+			raise BinaryPlistError('unable to map %s: %s' % (filename, e))
+	return BinaryPlistDecoder(data, lazy=True).decode()
+
+# opens a plist file, binary or XML, and returns its top object: binary plists are decoded
+# lazily (see openBinaryPlist), XML ones are read in full (see readXmlPlist)
+def openPlist(filename):
+	with open(filename, 'rb') as fh:
+		if not fh.read(8).startswith('bplist'):
+			fh.seek(0)
+			return readXmlPlist(fh)
+	return openBinaryPlist(filename)
 
 # ------------------------------------------------------------------------------------------------------------------------
 
-# reads an ARRAY node and returns a python list with elements
-def readArray(arrayNode):
-	ritorno = []
-	
-	# check if it really is a dict node
-	if (arrayNode.localName != "array"):
-		print("Node under test is not an array (it is more likely a \"%s\")."%node.localName)
-		return ritorno
-	
-	for node in arrayNode.childNodes:
-		if (node.nodeType == node.TEXT_NODE): continue
-		ritorno.append(node)
-	
-	return ritorno
+# characters that can not appear in an XML document
+_invalidXmlChars = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+def _xmlText(value):
+	if isinstance(value, str):
+		value = value.decode('latin-1')
+	value = _invalidXmlChars.sub(u'\ufffd', value)
+	return value.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(u'>', u'&gt;')
+
+def _writeXml(value, indent, lines):
+	tabs = u'\t' * indent
+	if isinstance(value, collections.Mapping):
+		lines.append(tabs + u'<dict>')
+		for key in sorted(value):
+			lines.append(u'%s\t<key>%s</key>' % (tabs, _xmlText(unicode(key))))
+			_writeXml(value[key], indent + 1, lines)
+		lines.append(tabs + u'</dict>')
+	elif isinstance(value, (list, tuple, PlistArray)):
+		lines.append(tabs + u'<array>')
+		for item in value:
+			_writeXml(item, indent + 1, lines)
+		lines.append(tabs + u'</array>')
+	elif isinstance(value, bool):
+		lines.append(tabs + (u'<true/>' if value else u'<false/>'))
+	elif isinstance(value, (int, long)):
+		lines.append(u'%s<integer>%i</integer>' % (tabs, value))
+	elif isinstance(value, float):
+		lines.append(u'%s<real>%r</real>' % (tabs, value))
+	elif isinstance(value, datetime.datetime):
+		lines.append(u'%s<date>%s</date>' % (tabs, value.strftime('%Y-%m-%dT%H:%M:%SZ')))
+	elif isinstance(value, plistlib.Data):
+		# lines of 76 chars at most, counting tabs as 8 chars
+		encoded = base64.b64encode(value.data)
+		width = max(76 - 8 * indent, 16)
+		lines.append(tabs + u'<data>')
+		for i in range(0, len(encoded), width):
+			lines.append(tabs + encoded[i:i + width])
+		lines.append(tabs + u'</data>')
+	elif value is None:
+		# plists have no null in their XML form
+		lines.append(tabs + u'<string></string>')
+	else:
+		lines.append(u'%s<string>%s</string>' % (tabs, _xmlText(value)))
+
+# returns the XML plist (utf-8 encoded) representing the given native python object
+def plistToXml(value):
+	lines = [
+		u'<?xml version="1.0" encoding="UTF-8"?>',
+		u'<!DOCTYPE plist PUBLIC "-//Apple Computer//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">',
+		u'<plist version="1.0">',
+	]
+	_writeXml(value, 0, lines)
+	lines.append(u'</plist>')
+	lines.append(u'')
+	return u'\n'.join(lines).encode('utf-8')
 
 # ------------------------------------------------------------------------------------------------------------------------
 
-# reads a binary plist file and returns the content in clear text format
+# reads a plist file and returns the content in clear text (XML) format
 def readPlist(filename):
-	
-	retstring = ""
-	
-	tempfile = os.path.dirname(sys.argv[0]) + "/out.plist" #default name from perl script plutil.pl
-	command = "perl \"" + os.path.dirname(sys.argv[0]) + "/IPBAplutil.pl\" \"%s\" "%filename
-	
-	#TODO: should this be called twice?
-	os.system(command)
-
 	try:
-		retval = os.system(command)	
-	except:
-		print "Unexpected error while running command: \"%s\""%command, sys.exc_info()[1]
-		return ""
-	
-	if (retval != 0):
-		print("Return value not clear. Unable to decode data.")
+		with open(filename, 'rb') as fh:
+			data = fh.read()
+	except IOError as e:
+		print("Unable to read plist file: %s" % e)
 		return ""
 
-	with open(tempfile, 'rb') as fh:
-		line = fh.readline()
-		retstring = ""
-		while line:
-			retstring += line
-			line = fh.readline()
-				
-	os.remove(tempfile)
+	# text plists are already readable
+	if not data.startswith('bplist'):
+		return data
 	
-	return retstring
+	try:
+		return plistToXml(BinaryPlistDecoder(data).decode())
+	except BinaryPlistError as e:
+		print("Unable to decode binary plist %s: %s" % (filename, e))
+		return ""
 
 # ------------------------------------------------------------------------------------------------------------------------
 
-# reads a binary plist file and returns the content in xml.dom.minidom object
+# reads a plist file (binary or XML) and returns the content in xml.dom.minidom object
 def readPlistToXml(filename):
 
-	tempfile = os.path.dirname(sys.argv[0]) + "/out.plist" #default name from perl script plutil.pl
-	command = "perl \"" + os.path.dirname(sys.argv[0]) + "/IPBAplutil.pl\" \"%s\" "%filename
-
-	try:
-		retval = os.system(command)	
-	except:
-		print "Unexpected error while running command: \"%s\""%command, sys.exc_info()[1]
-		return None
-	
-	if (retval != 0):
-		print("Return value not clear. Unable to decode data.")
+	text = readPlist(filename)
+	if not text:
 		return None
 	
-	from xml.dom.minidom import parse
+	from xml.dom.minidom import parseString
 	try:
-		xmldata = parse(tempfile)
+		xmldata = parseString(text)
 	except:
 		print "Unexpected error while parsing XML data:", sys.exc_info()[1]
 		return None
 	
-	os.remove(tempfile)
-	
 	return xmldata	
 
+# XML plist parsing -----------------------------------------------------------------------------------------
+
+class XmlPlistError(Exception):
+	pass
+
+_xmlDate = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?Z?$')
+
+def _xmlValue(elem):
+	# the value of a leaf element
+	tag = elem.tag
+	text = elem.text or ''
+	if tag == 'string' or tag == 'ustring':
+		return text
+	if tag == 'integer':
+		return int(text.strip())
+	if tag == 'real':
+		return float(text.strip())
+	if tag == 'true':
+		return True
+	if tag == 'false':
+		return False
+	if tag == 'date':
+		match = _xmlDate.match(text.strip())
+		if not match:
+			raise XmlPlistError('invalid date: %s' % text)
+		fields = [int(field) for field in match.groups()[:6]]
+		fraction = match.group(7) or ''
+		return datetime.datetime(*fields, microsecond=int(fraction.ljust(6, '0')))
+	if tag == 'data':
+		return plistlib.Data(base64.b64decode(''.join(text.split())))
+	raise XmlPlistError('unknown plist element <%s>' % tag)
+
+# reads an XML plist (a file name or a file object) in a single pass, and returns its top
+# object as native python objects (the same ones readBinaryPlist returns); the parsed
+# elements are discarded as soon as their value is read
+def readXmlPlist(source):
+	containers = []		# the dicts and lists being filled, with their pending key
+	elements = []		# the open elements, so that read ones can be dropped
+	top = None
+	try:
+		for event, elem in ElementTree.iterparse(source, events=('start', 'end')):
+			if event == 'start':
+				elements.append(elem)
+				if elem.tag == 'dict':
+					containers.append([{}, None])
+				elif elem.tag == 'array':
+					containers.append([[], None])
+				continue
+
+			elements.pop()
+			tag = elem.tag
+			if tag == 'plist':
+				break
+			if tag == 'key':
+				if not containers:
+					raise XmlPlistError('<key> outside of a dict')
+				containers[-1][1] = elem.text or ''
+			else:
+				if tag == 'dict' or tag == 'array':
+					value = containers.pop()[0]
+				else:
+					value = _xmlValue(elem)
+
+				if not containers:
+					top = value
+				else:
+					container = containers[-1]
+					if isinstance(container[0], list):
+						container[0].append(value)
+					elif container[1] is None:
+						raise XmlPlistError('dict value without a key')
+					else:
+						container[0][container[1]] = value
+						container[1] = None
+
+			# drop the content read so far
+			if elements:
+				del elements[-1][:]
+			else:
+				elem.clear()
+	except (SyntaxError, ValueError, TypeError) as e:
+		raise XmlPlistError(str(e))
+	return top
+
+# reads a plist file, binary or XML, and returns its content as native python objects
+# (None if the file can not be read)
+def loadPlist(filename):
+	try:
+		with open(filename, 'rb') as fh:
+			if fh.read(8).startswith('bplist'):
+				return readBinaryPlist(filename)
+			fh.seek(0)
+			return readXmlPlist(fh)
+	except (IOError, BinaryPlistError, XmlPlistError) as e:
+		print("Unable to read plist file %s: %s" % (filename, e))
+		return None
+
+# decoded plists cache -------------------------------------------------------------------------------------
+
+def decodedSize(value):
+	"""Estimate the memory used by a decoded plist value: the size of each object in it
+	(shared objects are counted each time they are referred to)"""
+	size = 0
+	pending = [value]
+	while pending:
+		value = pending.pop()
+		size += sys.getsizeof(value)
+		if isinstance(value, dict):
+			pending.extend(value.iterkeys())
+			pending.extend(value.itervalues())
+		elif isinstance(value, (list, tuple, set, frozenset)):
+			pending.extend(value)
+	return size
+
+class PlistCache(object):
+	"""Keeps what was decoded from plist files, so that showing the same file again does
+	not decode it again.
+
+	Entries are keyed by the name of the file in the backup (the file id), its size and
+	its mtime, and by the kind of decoding. The memory tier keeps the most recently used
+	entries within maxBytes (see decodedSize). With a cacheDir, entries are also pickled
+	there and survive the session: file ids are the same in every backup, so each backup
+	needs a cacheDir of its own. Cached values are shared: callers must not modify them.
+	"""
+
+	def __init__(self, maxBytes=64*1024*1024, cacheDir=None):
+		self.maxBytes = maxBytes
+		self.cacheDir = cacheDir
+		self._entries = collections.OrderedDict()	# key -> (value, size)
+		self._bytes = 0
+
+	def get(self, filename, kind, decode):
+		"""Return decode(filename), decoding the file only if it is not in the cache
+		(None and '', what the decoders return on errors, are not cached)"""
+		try:
+			stat = os.stat(filename)
+		except OSError:
+			return decode(filename)
+		key = (os.path.basename(filename), stat.st_size, int(stat.st_mtime * 1000000), kind)
+
+		entry = self._entries.pop(key, None)
+		if entry is None:
+			value = self._readDisk(key)
+			if value is None:
+				value = decode(filename)
+				if value is None or value == '':
+					return value
+				self._writeDisk(key, value)
+			size = decodedSize(value)
+			entry = (value, size)
+			self._bytes += size
+		# most recently used last
+		self._entries[key] = entry
+		while self._bytes > self.maxBytes and len(self._entries) > 1:
+			self._bytes -= self._entries.popitem(last=False)[1][1]
+		return entry[0]
+
+	def clear(self):
+		self._entries.clear()
+		self._bytes = 0
+
+	def loadPlist(self, filename):
+		"""Cached loadPlist"""
+		return self.get(filename, 'value', loadPlist)
+
+	def readPlist(self, filename):
+		"""Cached readPlist"""
+		return self.get(filename, 'text', readPlist)
+
+	def _diskFile(self, key):
+		return os.path.join(self.cacheDir, '%s-%i-%i-%s.pickle' % key)
+
+	def _readDisk(self, key):
+		if not self.cacheDir:
+			return None
+		try:
+			with open(self._diskFile(key), 'rb') as fh:
+				return cPickle.load(fh)
+		except Exception:
+			return None
+
+	def _writeDisk(self, key, value):
+		if not self.cacheDir:
+			return
+		try:
+			if not os.path.isdir(self.cacheDir):
+				os.makedirs(self.cacheDir)
+			diskFile = self._diskFile(key)
+			with open(diskFile + '.tmp', 'wb') as fh:
+				cPickle.dump(value, fh, cPickle.HIGHEST_PROTOCOL)
+			os.rename(diskFile + '.tmp', diskFile)
+		except (EnvironmentError, cPickle.PicklingError) as e:
+			print("Unable to write the plist cache: %s" % e)
+
+# the cache used by the UI and the plugins
+plistCache = PlistCache()
+
 # ------------------------------------------------------------------------------------------------------------------------
 
 # read backup properties from passed file (Info.plist)
 
 def deviceInfo(filename):
 
-	from xml.dom.minidom import parse
-	try:
-		manifest = parse(filename)
-	except:
+	data = loadPlist(filename)
+	if not isinstance(data, dict):
 		print("There was an error while parsing Manifest.plist.")
 		return {}
 
-	# <plist>
-	document = manifest.getElementsByTagName("plist")
-	# main <dict>
-	basedict = document[0].childNodes[1]
-	
-	data = readDict(basedict)
-
 	proplist = (
 		"Device Name",
 		"Display Name",
@@ -158,6 +563,6 @@ def deviceInfo(filename):
 	
 	for key in data:
 		if (key in proplist):
-			properties[key] = data[key].firstChild.toxml()
+			properties[key] = data[key]
 
 	return properties
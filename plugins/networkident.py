@@ -80,19 +80,12 @@ def OnClick(event):
 	
 	textarea.delete(1.0, END)
 	
-	id_string = sig_dict['Identifier'].firstChild.toxml()
+	id_string = sig_dict['Identifier']
 	
 	textarea.insert(END, "Network data\n")
 	textarea.insert(END, "\n")	
 	
-	#2011-12-27T17:35:53.290510Z
-	timestamp_string = sig_dict['Timestamp'].firstChild.toxml()
-	if ("." in timestamp_string):
-		timestamp_string = timestamp_string.split(".")[0] 
-	timestamp = datetime.datetime.strptime(
-		timestamp_string,
-		"%Y-%m-%dT%H:%M:%S"
-	)
+	timestamp = sig_dict['Timestamp'].replace(microsecond=0)
 	textarea.insert(END, "Network last seen in date: %s\n"%timestamp)	
 	
 	# parse identification for IPv4 routers
@@ -104,32 +97,30 @@ def OnClick(event):
 		textarea.insert(END, "Network identifier: %s\n"%id_string)	
 
 	# parse services dict
-	services = plistutils.readArray(sig_dict['Services'])
-	for service in services:
+	services = sig_dict['Services']
+	for service_dict in services:
 		textarea.insert(END, "\n")
 		textarea.insert(END, "****** Service\n")
 		
-		service_dict = plistutils.readDict(service)
-		textarea.insert(END, "Service ID: %s\n"%service_dict['ServiceID'].firstChild.toxml())
+		textarea.insert(END, "Service ID: %s\n"%service_dict['ServiceID'])
 		
 		for key in service_dict.keys():
 		
-			if (service_dict[key].nodeName != 'dict'):
+			if (not isinstance(service_dict[key], dict)):
 				continue
 		
 			textarea.insert(END, "%s data\n"%key)
-			single_service = plistutils.readDict(service_dict[key])
+			single_service = service_dict[key]
 			
 			for element_key in single_service.keys():
 				element = single_service[element_key]
 				
-				if (element.nodeName == 'string'):
-					textarea.insert(END, "- %s: %s\n"%(element_key, element.firstChild.toxml()))
-				elif (element.nodeName == 'array'):
+				if (isinstance(element, basestring)):
+					textarea.insert(END, "- %s: %s\n"%(element_key, element))
+				elif (isinstance(element, list)):
 					textarea.insert(END, "- %s\n"%(element_key))
-					element_array = plistutils.readArray(element)
-					for element_array_single in element_array:
-						textarea.insert(END, "  - %s\n"%(element_array_single.firstChild.toxml()))
+					for element_array_single in element:
+						textarea.insert(END, "  - %s\n"%(element_array_single))
 				else:
 					textarea.insert(END, "- %s: %s\n"%(element_key, element))
 				
@@ -211,46 +202,29 @@ def main(mbdb, backup_path):
 	# destroy window when closed
 	netidentwindow.protocol("WM_DELETE_WINDOW", netidentwindow.destroy)
 	
-	# convert binary plist file into plain plist file
-	netidentxml = plistutils.readPlistToXml(filename)
-	if (netidentxml == None):
+	# read plist file
+	maindict = plistutils.plistCache.loadPlist(filename)
+	if (not isinstance(maindict, dict)):
 		print("Error while parsing binary plist data")
 		return
-	
-	# main dictionary (contains anything else)
-	maindicts = netidentxml.getElementsByTagName('dict')
-	if (len(maindicts) <= 0): 
-		print("no main dict found in file")
-		return
-	maindict = maindicts[0]
 
 	# extract Signatures array
-	maindictelements = plistutils.readDict(maindict)
 	try:
-		signatures = maindictelements['Signatures']
+		signatures_array = maindict['Signatures']
 	except:
 		print("No Signatures array found in main dict")
 		return
-	signatures_array = plistutils.readArray(signatures)
 	
 	# footer statistics
 	footerlabel.set("Found %i identified networks."%(len(signatures_array)))
 	
 	id_number = 0
 	
-	for signature in signatures_array:
-		sig_dict = plistutils.readDict(signature)
+	for sig_dict in signatures_array:
 		
-		id_string = sig_dict['Identifier'].firstChild.toxml()
+		id_string = sig_dict['Identifier']
 		
-		#2011-12-27T17:35:53.290510Z
-		timestamp_string = sig_dict['Timestamp'].firstChild.toxml()
-		if ("." in timestamp_string):
-			timestamp_string = timestamp_string.split(".")[0] 
-		timestamp = datetime.datetime.strptime(
-			timestamp_string,
-			"%Y-%m-%dT%H:%M:%S"
-		)
+		timestamp = sig_dict['Timestamp'].replace(microsecond=0)
 		
 		elem_id = ""
 		
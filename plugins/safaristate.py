@@ -72,34 +72,34 @@ def OnClick(event):
 	textarea.insert(END, "\n")	
 	
 	try:
-		title_string = sig_dict['SafariStateDocumentTitle'].firstChild.toxml()
+		title_string = sig_dict['SafariStateDocumentTitle']
 	except:
 		title_string = ""
 	
 	textarea.insert(END, "Page title: %s\n"%title_string)
 
-	url_string = sig_dict['SafariStateDocumentURL'].firstChild.toxml()
+	url_string = sig_dict['SafariStateDocumentURL']
 	textarea.insert(END, "Page url: %s\n"%url_string)
 	
-	timestamp_val = float(sig_dict['SafariStateDocumentLastViewedTime'].firstChild.toxml())
+	timestamp_val = float(sig_dict['SafariStateDocumentLastViewedTime'])
 	timestamp_val = timestamp_val + 978307200 #JAN 1 1970
 	timestamp = datetime.datetime.fromtimestamp(timestamp_val)
 	timestamp = timestamp.strftime("%Y-%m-%d %H:%M")
 	textarea.insert(END, "Last viewed in date: %s\n"%timestamp)	
 
 	# parse back forward list
-	backforwardlist_info = plistutils.readDict(sig_dict['SafariStateDocumentBackForwardList'])
+	backforwardlist_info = sig_dict['SafariStateDocumentBackForwardList']
 	
 	textarea.insert(END, "\n")
 	textarea.insert(END, "Back/forward list data\n")
-	textarea.insert(END, "Capacity: %s\n"%(backforwardlist_info['capacity'].firstChild.toxml()))
-	current = int(backforwardlist_info['current'].firstChild.toxml())
+	textarea.insert(END, "Capacity: %s\n"%(backforwardlist_info['capacity']))
+	current = int(backforwardlist_info['current'])
 	textarea.insert(END, "Current: %i\n"%(current))
 	
-	backforwardlist = plistutils.readArray(backforwardlist_info['entries'])
+	backforwardlist = backforwardlist_info['entries']
 	
 	actual = 0
-	for backforward in backforwardlist:
+	for backforward_dict in backforwardlist:
 		
 		actual_string = ""
 		if (actual == current):
@@ -108,9 +108,8 @@ def OnClick(event):
 		textarea.insert(END, "\n")
 		textarea.insert(END, "****** Back/Forward list element %i %s\n"%(actual, actual_string))
 		
-		backforward_dict = plistutils.readDict(backforward)
-		textarea.insert(END, "Title: %s\n"%(backforward_dict['title'].firstChild.toxml()))
-		textarea.insert(END, "URL: %s\n"%(backforward_dict['-'].firstChild.toxml()))
+		textarea.insert(END, "Title: %s\n"%(backforward_dict['title']))
+		textarea.insert(END, "URL: %s\n"%(backforward_dict['']))
 		
 		actual = actual + 1
 				
@@ -194,44 +193,34 @@ def main(mbdb, backup_path):
 	# destroy window when closed
 	safstatewindow.protocol("WM_DELETE_WINDOW", safstatewindow.destroy)
 	
-	# convert binary plist file into plain plist file
-	safstatexml = plistutils.readPlistToXml(filename)
-	if (safstatexml == None):
+	# read plist file
+	maindict = plistutils.plistCache.loadPlist(filename)
+	if (not isinstance(maindict, dict)):
 		print("Error while parsing binary plist data")
 		return
-	
-	# main dictionary (contains anything else)
-	maindicts = safstatexml.getElementsByTagName('dict')
-	if (len(maindicts) <= 0): 
-		print("no main dict found in file")
-		return
-	maindict = maindicts[0]
 
 	# extract SafariStateDocuments array
-	maindictelements = plistutils.readDict(maindict)
 	try:
-		safstatedocs = maindictelements['SafariStateDocuments']
+		safstatedocs_array = maindict['SafariStateDocuments']
 	except:
 		print("No SafariStateDocuments array found in main dict")
 		return
 		
-	active_tab = int(maindictelements['SafariStateActiveDocumentIndex'].firstChild.toxml())
-	safstatedocs_array = plistutils.readArray(safstatedocs)
+	active_tab = int(maindict['SafariStateActiveDocumentIndex'])
 	
 	# footer statistics
 	footerlabel.set("Found %i open tabs."%(len(safstatedocs_array)))
 	
 	id_number = 0
 	
-	for safstatedoc in safstatedocs_array:
-		safstatedoc_dict = plistutils.readDict(safstatedoc)
+	for safstatedoc_dict in safstatedocs_array:
 
 		try:
-			title = safstatedoc_dict['SafariStateDocumentTitle'].firstChild.toxml()		
+			title = safstatedoc_dict['SafariStateDocumentTitle']
 		except:
 			title = ""
 				
-		timestamp_val = float(safstatedoc_dict['SafariStateDocumentLastViewedTime'].firstChild.toxml())
+		timestamp_val = float(safstatedoc_dict['SafariStateDocumentLastViewedTime'])
 		timestamp_val = timestamp_val + 978307200 #JAN 1 1970
 		timestamp = datetime.datetime.fromtimestamp(timestamp_val)
 		timestamp = timestamp.strftime("%Y-%m-%d %H:%M")
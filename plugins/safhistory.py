@@ -65,6 +65,31 @@ def OnDoubleClick(event):
 	nodeurl = historytree.set(historytree.selection(), "url")
 	webbrowser.open(nodeurl)
 
+# Reads the bookmarks from the history plist ---------------------------------------------------
+
+def readHistory(filename):
+	# the history plist is only decoded where it is read (when binary, some versions of
+	# Safari write it as XML)
+	try:
+		history = plistutils.openPlist(filename)
+		bookmarksArray = history['WebHistoryDates']
+	except (IOError, plistutils.BinaryPlistError, plistutils.XmlPlistError, KeyError, TypeError) as e:
+		print("Error while parsing Safari History Data: %s" % e)
+		return None
+	
+	bookmarks = []
+	
+	# decode each bookmark dict
+	for element in bookmarksArray:
+		
+		bookmark = {}
+		bookmark['title'] = element.get('title', "")
+		bookmark['url'] = element.get('', "")
+		bookmark['date'] = element.get('lastVisitedDate', "")
+		bookmarks.append(bookmark)
+	
+	return bookmarks
+
 # MAIN FUNCTION --------------------------------------------------------------------------------
 	
 def main(mbdb, backup_path):
@@ -90,46 +115,9 @@ def main(mbdb, backup_path):
 	contactstitle = Label(historywindow, text = "Safari History data from: " + filename, relief = RIDGE)
 	contactstitle.grid(column = 0, row = 0, sticky="ew", padx=5, pady=5)
 
-	# convert binary plist file into plain plist file
-	historyxml = plistutils.readPlistToXml(filename)
-	if (historyxml == None):
-		print("Error while parsing Safari History Data")
+	bookmarks = plistutils.plistCache.get(filename, 'safhistory', readHistory)
+	if (bookmarks == None):
 		return
-	
-	# main dictionary (contains anything else)
-	maindicts = historyxml.getElementsByTagName('dict')
-	if (len(maindicts) <= 0): 
-		print("no main dict found in file")
-		return
-	maindict = maindicts[0]
-	
-	# read WebHistoryDates array of dicts (one dict for each bookmark)
-	from plistutils import readDict, readArray
-	outerDict = readDict(maindict)
-	bookmarksArray = readArray(outerDict['WebHistoryDates'])
-	
-	bookmarks = []
-	
-	# decode each bookmark dict
-	for element in bookmarksArray:
-		
-		bookmark = {}
-		
-		elementDict = readDict(element)
-		
-		bookmark['title'] = ""
-		if ('title' in elementDict.keys()):
-			bookmark['title'] = elementDict['title'].firstChild.toxml()
-		
-		bookmark['url'] = ""
-		if ('-' in elementDict.keys()):
-			bookmark['url'] = elementDict['-'].firstChild.toxml()
-		
-		bookmark['date'] = ""
-		if ('lastVisitedDate' in elementDict.keys()):
-			bookmark['date'] = elementDict['lastVisitedDate'].firstChild.toxml()
-		
-		bookmarks.append(bookmark)
 
 	# tree
 	historytree = ttk.Treeview(historywindow, columns=("title", "url"),
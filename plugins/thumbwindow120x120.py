@@ -19,6 +19,7 @@ from datetime import datetime
 import os
 import sqlite3
 from PIL import Image, ImageTk
+from hexformat import dump
 
 # GLOBALS -----------------------------------------------------------------------------------------
 
@@ -46,20 +47,6 @@ def autoscroll(sbar, first, last):
     #    sbar.grid()
     sbar.set(first, last)
 
-def dump(src, length=8, limit=10000):
-	FILTER=''.join([(len(repr(chr(x)))==3) and chr(x) or '.' for x in range(256)])
-	N=0; result=''
-	while src:
-		s,src = src[:length],src[length:]
-		hexa = ' '.join(["%02X"%ord(x) for x in s])
-		s = s.translate(FILTER)
-		result += "%04X   %-*s   %s\n" % (N, length*3, hexa, s)
-		N+=length
-		if (len(result) > limit):
-			src = "";
-			result += "(analysis limit reached after %i bytes)"%limit
-	return result
-
 # Called when the user clicks on the main tree list -----------------------------------------------
 
 def OnClick(event):
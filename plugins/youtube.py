@@ -12,6 +12,7 @@
 
 PLUGIN_NAME = "YouTube Browser"
 import plugins_utils
+import plistutils
 
 from Tkinter import *
 import ttk
@@ -257,42 +258,16 @@ def main(mbdb, backup_path):
 	youtubewindow.protocol("WM_DELETE_WINDOW", youtubewindow.destroy)
 	
 	# reading plist
-	from xml.dom.minidom import parse
-	try:
-		xmldata = parse(filename)
-	except:
-		print "Unexpected error while parsing XML data:", sys.exc_info()[1]
-		return None
-	
-	# main dictionary (contains anything else)
-	maindicts = xmldata.getElementsByTagName('dict')
-	if (len(maindicts) <= 0): 
+	outerDict = plistutils.loadPlist(filename)
+	if (not isinstance(outerDict, dict)):
 		print("no main dict found in file")
 		return
-	maindict = maindicts[0]
 	
 	# read data from main dict 
-	outerDict = plugins_utils.readDict(maindict)
-	
-	if ("Bookmarks" in outerDict.keys()):
-		bookmarksArray = plugins_utils.readArray(outerDict['Bookmarks'])
-	else:
-		bookmarksArray = []
-	
-	if ("History" in outerDict.keys()):
-		historyArray = plugins_utils.readArray(outerDict['History'])
-	else:
-		historyArray = []
-	
-	if ("lastSearch" in outerDict.keys()):	
-		lastSearch = outerDict['lastSearch'].firstChild.toxml()
-	else:
-		lastSearch = "Not available"
-
-	if ("lastViewedVideo" in outerDict.keys()):
-		lastViewedVideo = outerDict['lastViewedVideo'].firstChild.toxml()
-	else:
-		lastViewedVideo = None
+	bookmarksArray = outerDict.get('Bookmarks', [])
+	historyArray = outerDict.get('History', [])
+	lastSearch = outerDict.get('lastSearch', "Not available")
+	lastViewedVideo = outerDict.get('lastViewedVideo', None)
 	
 	# footer statistics
 	footerlabel.set("Found %i history elements and %i bookmarks."%(len(historyArray), len(bookmarksArray)))
@@ -304,14 +279,14 @@ def main(mbdb, backup_path):
 	# bookmarks in the main tree
 	bookmarksnode = youtubetree.insert('', 'end', text="", values=("Bookmarks", "B"))
 	for element in bookmarksArray:
-		element_string = element.firstChild.toxml()
+		element_string = element
 		youtubetree.insert(bookmarksnode, 'end', text="", 
 			values=(element_string, element_string))	
 
 	# history in the main tree
 	historynode = youtubetree.insert('', 'end', text="", values=("History", "H"))
 	for element in historyArray:
-		element_string = element.firstChild.toxml()
+		element_string = element
 		youtubetree.insert(historynode, 'end', text="", 
 			values=(element_string, element_string))	
 	
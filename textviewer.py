@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+ Paged text viewer for iPBA
+
+ The file is memory mapped and only the lines of the page shown are read. Pages are
+ found through a sparse index of line offsets (one line out of step), built by a
+ background thread; the index never holds more than maxEntries offsets; when it is
+ full, every other one is dropped and step doubles.
+'''
+
+import os
+import mmap
+import array
+import threading
+
+class TextViewer(object):
+	maxEntries = 65536
+	# bytes read at a time by the indexer, and at most in a page (for very long lines)
+	blockSize = 1024 * 1024
+	maxPageBytes = 1024 * 1024
+
+	def __init__(self, filename, lines=500, step=64, encoding='utf-8'):
+		"""Show the file as pages of the given number of lines, starting from the first
+		page. The index is built in the background, the pages can be read meanwhile."""
+		self.filename = filename
+		self.pageLines = lines
+		self.encoding = encoding
+
+		# number of lines of the file, None until the index is complete
+		self.lineCount = None
+
+		self._file = open(filename, 'rb')
+		try:
+			self.size = os.fstat(self._file.fileno()).st_size
+			# an empty file can not be mapped
+			if self.size:
+				self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+			else:
+				self._data = ''
+		except:
+			self._file.close()
+			raise
+
+		# offset of lines 0, step, 2 * step...
+		self._step = step
+		self._index = array.array('L', [0])
+		self._indexedLines = 0
+		self._lock = threading.Lock()
+		self._stopped = False
+
+		self.firstLine = 0
+		self._offset = 0
+		self._end = self._pageEnd(0)
+
+		self._indexer = threading.Thread(target=self._buildIndex)
+		self._indexer.daemon = True
+		self._indexer.start()
+
+	def close(self):
+		self._stopped = True
+		self._indexer.join()
+		if self.size:
+			self._data.close()
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def indexed(self):
+		return self.lineCount is not None
+
+	def _buildIndex(self):
+		# the lines ending in each block are counted from the lengths of its pieces, the
+		# offsets are only computed for the lines of the index
+		lines = 0
+		start = 0
+		while start < self.size and not self._stopped:
+			block = self._data[start:start + self.blockSize]
+			lengths = map(len, block.split('\n'))
+			newlines = len(lengths) - 1
+
+			with self._lock:
+				piece = 0
+				offset = start
+				nextEntry = len(self._index) * self._step
+				while nextEntry <= lines + newlines:
+					# the line starts after the newline ending piece (nextEntry - lines - 1)
+					end = nextEntry - lines
+					offset += sum(lengths[piece:end]) + (end - piece)
+					piece = end
+					self._index.append(offset)
+					if len(self._index) > self.maxEntries:
+						self._index = self._index[::2]
+						self._step *= 2
+					nextEntry = len(self._index) * self._step
+				self._indexedLines = lines + newlines
+
+			lines += newlines
+			start += len(block)
+
+		if not self._stopped:
+			# the last line may not end with a newline
+			if self.size and self._data[self.size - 1] != '\n':
+				lines += 1
+			self.lineCount = lines
+
+	def _lineOffset(self, line):
+		# offset of the start of the line (the size of the file, past the last line)
+		with self._lock:
+			entry = min(line // self._step, len(self._index) - 1)
+			offset = self._index[entry]
+			current = entry * self._step
+		# the lines after the index entry (all of them, while the file is being indexed) are
+		# skipped by counting the newlines of whole blocks, then of halves of the block that
+		# holds the line, down to a small block that is split
+		size = self.blockSize
+		while current < line:
+			if offset >= self.size:
+				return self.size
+			block = self._data[offset:offset + size]
+			newlines = block.count('\n')
+			if current + newlines < line:
+				current += newlines
+				offset += len(block)
+			elif size > 4096:
+				size //= 2
+			else:
+				offset += len(block) - len(block.split('\n', line - current)[-1])
+				current = line
+		return offset
+
+	def _pageEnd(self, offset):
+		# offset after the last line of the page starting at offset
+		end = offset
+		for i in xrange(self.pageLines):
+			newline = self._data.find('\n', end, min(self.size, offset + self.maxPageBytes))
+			if newline < 0:
+				return min(self.size, offset + self.maxPageBytes)
+			end = newline + 1
+		return end
+
+	def page(self):
+		"""Return the text of the current page"""
+		return self._data[self._offset:self._end].decode(self.encoding, 'replace')
+
+	def goto(self, line):
+		"""Show the page starting with the line (from 0, clamped to the file), return it"""
+		line = max(0, line)
+		if self.lineCount is not None:
+			line = min(line, max(0, self.lineCount - 1))
+		offset = self._lineOffset(line)
+		if offset >= self.size and line > 0:
+			# past the end of the file (while it is being indexed): stay on this page
+			return self.page()
+		self.firstLine = line
+		self._offset = offset
+		self._end = self._pageEnd(offset)
+		return self.page()
+
+	def nextPage(self):
+		# continues from the end of the current page, the index is not needed
+		if self._end < self.size:
+			self.firstLine += self._data[self._offset:self._end].count('\n')
+			self._offset = self._end
+			self._end = self._pageEnd(self._offset)
+		return self.page()
+
+	def atEnd(self):
+		"""Whether the current page holds the end of the file"""
+		return self._end >= self.size
+
+	def previousPage(self):
+		return self.goto(self.firstLine - self.pageLines)
+
+	def status(self):
+		"""Describe the position of the current page in the file"""
+		if self.lineCount is None:
+			total = 'at least %i (indexing)' % self._indexedLines
+		else:
+			total = '%i' % self.lineCount
+		# a page cut by maxPageBytes, or the end of a file with no final newline, ends with
+		# a line that has no newline of its own
+		lines = self._data[self._offset:self._end].count('\n')
+		if self._end > self._offset and self._data[self._end - 1] != '\n':
+			lines += 1
+		status = 'Lines %i-%i of %s' % (self.firstLine + 1, self.firstLine + max(1, lines), total)
+		if self._offset > 0 and self._data[self._offset - 1] != '\n':
+			# the page after one cut by maxPageBytes
+			status += ' (from the middle of line %i)' % (self.firstLine + 1)
+		return status